@@ -51,6 +51,13 @@ for M in Ms:
     for j in range(M + 1):
         calculated_averages[M][j / M] = calculated_averages[M][j / M] / M_total * M
 
+# M = infinity: the mean density of the limit model, by the method of characteristics
+infinite_model = OneDimensionalNonCollaborative.get_limit_model().get_deterministic_model()
+largest_M = max(Ms)
+infinite_initial = {j / largest_M: count for j, count in enumerate(initial_states[largest_M]) if count > 0}
+infinite_counts = infinite_model.run(parameters, infinite_initial, timepoint)
+infinite_average = dict(zip(infinite_model.bin_centers, infinite_model.to_density(infinite_counts)))
+
 for i, data in enumerate([simulated_averages, calculated_averages]):
     fig, ax = plt.subplots()
     if i == 0:
@@ -62,6 +69,10 @@ for i, data in enumerate([simulated_averages, calculated_averages]):
         xs = list(series.keys())
         ys = [series[x] for x in xs]
         ax.plot(xs, ys, label = f"{M} sites", linewidth=2)
+    if name == "calculated":
+        xs = list(infinite_average.keys())
+        ys = [infinite_average[x] for x in xs]
+        ax.plot(xs, ys, label = "infinitely many sites", linewidth=2)
     
     ax.set_xlabel("Fraction of sites Methylated")
     ax.set_ylabel(f"Relative Likelihood a living cell will be at this methylation level at time t=10")
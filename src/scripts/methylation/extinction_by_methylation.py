@@ -16,12 +16,14 @@ base_parameters["p"] = 1
 r_mus = [0.01, 0.1, 0.3, 1, 10]
 ratio = 2
 results = []
+extinction = None
 for r_mu in r_mus:
     parameters = copy(base_parameters)
     parameters["r_mu"] = r_mu
     parameters["r_um"] = ratio * r_mu
-    extinction_probabilities = infinite_model.calculate_extinction(
-        parameters, point_count=point_count)
+    # warm start from the previous r_mu
+    extinction = infinite_model.solve_extinction(parameters, initial_guess=extinction)
+    extinction_probabilities = extinction([i / (point_count - 1) for i in range(point_count)])
     extinction_dict = {}
     for i, probability in enumerate(extinction_probabilities):
         extinction_dict[i / (point_count - 1)] = probability
@@ -0,0 +1,25 @@
+"""Compares odeint's work on the PDMP flow with and without the analytic Jacobian."""
+from src.tools.models.pdmp import PDMP
+from src.constants import BISTABLE_PDMP_PARAMS, BISTABLE_STRONG_PDMP_PARAMS
+from scipy.integrate import odeint
+import numpy as np
+import time
+
+model = PDMP()
+times = np.linspace(0, 50, 501)
+initial_states = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 0.5, 0.5]]
+
+for name, parameters in [("bistable", BISTABLE_PDMP_PARAMS), ("bistable strong", BISTABLE_STRONG_PDMP_PARAMS)]:
+    flow = model.flow(parameters)
+    jacobian = model.jacobian(parameters)
+    for label, dfun in [("finite differences", None), ("analytic Jacobian", jacobian)]:
+        evaluations = 0
+        jacobian_evaluations = 0
+        start = time.perf_counter()
+        for initial_state in initial_states:
+            _, info = odeint(flow, initial_state, times, Dfun=dfun, tfirst=True, full_output=True)
+            evaluations += info["nfe"][-1]
+            jacobian_evaluations += info["nje"][-1]
+        elapsed = time.perf_counter() - start
+        print(f"{name}, {label}: {evaluations} flow evaluations, "
+              f"{jacobian_evaluations} Jacobian evaluations, {elapsed * 1000:.1f} ms")
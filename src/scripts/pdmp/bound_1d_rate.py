@@ -1,5 +1,6 @@
 from src.tools.models.pdmp import PDMP
 from src.constants import BISTABLE_STRONG_PDMP_PARAMS
+import numpy as np
 
 flow = PDMP.flow(BISTABLE_STRONG_PDMP_PARAMS)
 
@@ -9,6 +10,16 @@ min_hemi = 0
 max_hemi = min(level, 1)
 
 def get_growth(h):
-    state = [1 - h / 2 - level / 2, h, (level - h) / 2]
+    """h may be a number or an array of hemimethylated fractions; the flow is evaluated on all of them at once"""
+    h = np.asarray(h, dtype=float)
+    state = np.stack([1 - h / 2 - level / 2, h, (level - h) / 2], axis=-1)
     change = flow(0, state)
-    
\ No newline at end of file
+    return change
+
+
+hs = np.linspace(min_hemi, max_hemi, 1001)
+growths = get_growth(hs)
+# bounds on the rate of change of (m, h, u) over the hemimethylated fractions of the level
+print(f"minimum: {growths.min(axis=0)}, at h = {hs[growths.argmin(axis=0)]}")
+print(f"maximum: {growths.max(axis=0)}, at h = {hs[growths.argmax(axis=0)]}")
+
@@ -17,8 +17,7 @@ starts = [i / 1000 for i in range(1000)]
 end = 1.8
 
 hitting = {}
-for start in starts:
-    hitting_time = model.get_hitting_time(parameters, start, end, stepsize = 0.001)
+for start, hitting_time in zip(starts, model.get_hitting_times(parameters, starts, end)):
     hitting[start] = hitting_time
     print(f"hitting time for {start}: {hitting_time}")
 
@@ -23,8 +23,8 @@ x = 0
 thresholds = [i / 1000 for i in range(999)]
 
 recovery = {}
-for threshold in thresholds:
-    recovery_time = model.get_hitting_time(parameters, threshold, threshold * 2, stepsize = 0.001)
+recovery_times = model.get_hitting_times(parameters, thresholds, [threshold * 2 for threshold in thresholds])
+for threshold, recovery_time in zip(thresholds, recovery_times):
     recovery[threshold] = recovery_time
     print(f"recovery time for {threshold}: {recovery_time}")
 
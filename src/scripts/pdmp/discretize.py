@@ -3,19 +3,15 @@ from src.constants import BISTABLE_STRONG_PDMP_PARAMS
 import numpy as np
 
 
-def get_hitting_times(hemimethylation_levels, parameters):
+def get_hitting_times(hemimethylation_levels, parameters, use_table=False):
     model = PDMP()
-    t_mat = []
-    for h1 in hemimethylation_levels:
-        t_list = []
-        for h2 in hemimethylation_levels:
-            if h2 <= h1 / 2:
-                t_list.append(0)
-                continue
-            hitting_time = model.get_hitting_time(parameters, h1, h2 * 2)
-            t_list.append(hitting_time)
-        t_mat.append(t_list)
-    return t_mat
+    levels = np.array(hemimethylation_levels)
+    if use_table:
+        # faster for many levels, but interpolated, so less accurate near the separatrix
+        table = model.get_hitting_time_table(parameters, persist=False)
+        return table(levels[:, None], 2 * levels[None, :]).tolist()
+    # every (h1, h2) pair is solved in one batch; pairs with h2 <= h1 / 2 start above the level and get 0
+    return model.get_hitting_times(parameters, levels[:, None], 2 * levels[None, :]).tolist()
     
 
 
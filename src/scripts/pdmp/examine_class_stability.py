@@ -1,4 +1,5 @@
 from src.tools.models.pdmp import PDMP
+from src.tools.models.timepoints import ArraySink, DecimatingSink
 from src.tools.plot import plot_dictionary_series
 import random
 import matplotlib.pyplot as plt
@@ -28,10 +29,12 @@ params = {
 }
 
 model = PDMP()
+logger.info("Switching rates from the transfer operator: %s", model.get_transfer_operator(params).get_switching_rates())
 
 initial_state = [0.4, 0.2, 0.4]
 times = [i / 10 for i in range(50001)]
-result = model.generate_timepoint_data(params, initial_state, times)
+# keep the extremes of every time unit, which is all the plot can show of 50001 points
+result = model.generate_timepoint_data(params, initial_state, times, sink=DecimatingSink(ArraySink(), 1))
 
 fig, ax = plt.subplots()
 
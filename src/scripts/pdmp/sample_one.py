@@ -48,7 +48,7 @@ if input("Resimulate data? y/n: ") == "y":
     times = [i / frequency for i in range(frequency * duration)]
     result = model.generate_timepoint_data(parameters, initial_state, times, splitting_times=jump_times)
     results.append(result)
-    json_object = json.dumps(result)
+    json_object = json.dumps(result.to_dict())
 
     with open(output_path, "w") as outfile:
         outfile.write(json_object)
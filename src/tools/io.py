@@ -2,11 +2,16 @@
 # pylint:disable=missing-function-docstring
 import json
 import csv
-from os import listdir
+from os import listdir, path
+
+import numpy as np
 
 BASE_PATH = "output"
 SIMULATION_PATH = "simulations"
 PLOT_PATH = "plots"
+TABLE_PATH = "tables"
+TRAJECTORY_PATH = "trajectories"
+EXPLORATION_PATH = "explorations"
 IGNORED_PREFIX = "."
 
 
@@ -26,6 +31,51 @@ def get_simulations():
     dir_path = f"{BASE_PATH}/{SIMULATION_PATH}/"
     return _get_tracked_files(dir_path)
 
+# read and write precomputed numerical tables
+
+def read_table(filename):
+    """Returns the dictionary of named arrays saved under filename."""
+    file_path = f"{BASE_PATH}/{TABLE_PATH}/{filename}.npz"
+    with np.load(file_path) as arrays:
+        return dict(arrays)
+
+def write_table(arrays, filename):
+    file_path = f"{BASE_PATH}/{TABLE_PATH}/{filename}.npz"
+    np.savez_compressed(file_path, **arrays)
+
+def has_table(filename):
+    return path.exists(f"{BASE_PATH}/{TABLE_PATH}/{filename}.npz")
+
+# stream long trajectories as raw float64 rows
+
+def get_trajectory_path(filename):
+    return f"{BASE_PATH}/{TRAJECTORY_PATH}/{filename}.bin"
+
+def read_trajectory(filename, column_count):
+    """Returns the (rows, column_count) array of a trajectory streamed to filename."""
+    return np.fromfile(get_trajectory_path(filename), dtype=np.float64).reshape(-1, column_count)
+
+# append rows of parameter explorations to csv files, one column per quantity
+
+def start_exploration(columns, filename):
+    """Creates filename with only the header columns, replacing any earlier exploration of that name."""
+    _write_csv(f"{BASE_PATH}/{EXPLORATION_PATH}/{filename}.csv", [columns])
+
+def append_exploration_rows(rows, filename):
+    with open(f"{BASE_PATH}/{EXPLORATION_PATH}/{filename}.csv", 'a', newline='', encoding='utf-8') as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter=',',
+                               quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csvwriter.writerows(rows)
+
+def has_exploration(filename):
+    return path.exists(f"{BASE_PATH}/{EXPLORATION_PATH}/{filename}.csv")
+
+def read_exploration(filename):
+    """Returns the dictionary {column: array of values} of an exploration."""
+    header, *rows = _read_csv(f"{BASE_PATH}/{EXPLORATION_PATH}/{filename}.csv")
+    values = np.array(rows, dtype=float).reshape(-1, len(header))
+    return {column: values[:, i] for i, column in enumerate(header)}
+
 # save figure
 
 def save_figure(fig, filename):
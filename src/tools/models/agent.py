@@ -0,0 +1,112 @@
+"""
+This module contains an agent-based model of a methylating cell population.
+Every cell carries the state of each of its M CpG sites, so questions about
+which specific sites are methylated can be answered.
+
+The population is a uint8 array with one row per cell and one byte per site
+(UNMETHYLATED, HEMIMETHYLATED or METHYLATED), so 1e5 cells with 100 sites take 10 MB.
+Rates follow SiteStateCollaborative, and time advances in small fixed steps
+during which every site and every cell is updated at once.
+"""
+
+import numpy as np
+
+from src.tools.models.methylation import get_methylation_level, get_site_switch_rates
+from src.tools.models.model import Model
+from src.tools.models.rng import get_numpy_generator
+
+UNMETHYLATED = 0
+HEMIMETHYLATED = 1
+METHYLATED = 2
+
+
+class AgentBasedCollaborative(Model):
+    """
+    Agent-based version of SiteStateCollaborative. The state is an (N, M) uint8 array of site states.
+        - Sites switch u <-> h <-> m at the collaborative rates of get_site_switch_rates.
+        - Birth and death rates vary linearly with the methylation level of the cell.
+        - At birth, methylated sites are hemimethylated in both daughters, and each hemimethylated
+          site is hemimethylated in one daughter and unmethylated in the other.
+
+    Each step of length time_step draws one uniform per site and one per cell,
+    so the simulation is exact up to O(time_step) errors from events within a step.
+    """
+    name = "Agent-Based Collaborative Methylation with Linear Fitness"
+
+    def __init__(self, M: int, chunk_size: int = 8192):
+        self.site_count = M
+        self.chunk_size = chunk_size  # rows updated at once, bounds the size of temporary arrays
+        self.name = f"{self.name} ({M} sites)"
+
+    def run(self, parameters, initial_state, duration, time_step=0.01, rng=None):
+        """Returns the (N, M) uint8 array of site states after duration. Does not mutate initial_state."""
+        if rng is None:
+            rng = get_numpy_generator()
+        sites = np.array(initial_state, dtype=np.uint8).reshape(-1, self.site_count)
+        current_time = 0
+        while current_time < duration and len(sites) > 0:
+            step = min(time_step, duration - current_time)
+            for start in range(0, len(sites), self.chunk_size):
+                self._switch_sites(parameters, sites[start:start + self.chunk_size], step, rng)
+            sites = self._divide_and_die(parameters, sites, step, rng)
+            current_time += step
+        return sites
+
+    def get_counts(self, sites):
+        """Returns the (N, 3) array of (N_u, N_h, N_m) counts of each cell."""
+        return np.stack([(sites == state).sum(axis=1) for state in
+                         (UNMETHYLATED, HEMIMETHYLATED, METHYLATED)], axis=1)
+
+    def get_methylated_distribution(self, sites):
+        """Returns the number of cells with 0, ..., M methylated sites
+        (the state of the one dimensional models)."""
+        return np.bincount((sites == METHYLATED).sum(axis=1), minlength=self.site_count + 1)
+
+    def get_initial_state(self, cell_count, methylated_count=0, hemimethylated_count=0):
+        """Returns cell_count identical cells whose first sites are methylated, then hemimethylated."""
+        sites = np.full((cell_count, self.site_count), UNMETHYLATED, dtype=np.uint8)
+        sites[:, :methylated_count] = METHYLATED
+        sites[:, methylated_count:methylated_count + hemimethylated_count] = HEMIMETHYLATED
+        return sites
+
+    def _switch_sites(self, parameters, sites, step, rng):
+        """Switches the sites of a block of cells in place."""
+        u, h, m = self.get_counts(sites).T
+        r_uh, r_hu, r_hm, r_mh = get_site_switch_rates(parameters, u, h, m, self.site_count)
+        leave_u = -np.expm1(-r_uh * step)[:, None]
+        leave_h = -np.expm1(-(r_hu + r_hm) * step)
+        to_u = (leave_h * np.divide(r_hu, r_hu + r_hm, out=np.zeros_like(leave_h),
+                                    where=r_hu + r_hm > 0))[:, None]
+        leave_h = leave_h[:, None]
+        leave_m = -np.expm1(-r_mh * step)[:, None]
+
+        # a single uniform per site decides whether and where it jumps
+        draws = rng.random(sites.shape, dtype=np.float32)
+        is_u = sites == UNMETHYLATED
+        is_h = sites == HEMIMETHYLATED
+        is_m = sites == METHYLATED
+        sites[is_u & (draws < leave_u)] = HEMIMETHYLATED
+        sites[is_h & (draws < to_u)] = UNMETHYLATED
+        sites[is_h & (draws >= to_u) & (draws < leave_h)] = METHYLATED
+        sites[is_m & (draws < leave_m)] = HEMIMETHYLATED
+
+    def _divide_and_die(self, parameters, sites, step, rng):
+        counts = self.get_counts(sites)
+        level = get_methylation_level(counts[:, 1], counts[:, 2], self.site_count)
+        birth = parameters["b_0"] * (1 - level) + parameters["b_M"] * level
+        death = parameters["d_0"] * (1 - level) + parameters["d_M"] * level
+        total = birth + death
+        happens = -np.expm1(-total * step)
+        draws = rng.random(len(sites)) * np.where(total > 0, total, 1)
+        dividing = (draws < happens * birth)
+        dying = ~dividing & (draws < happens * total)
+        if not dividing.any() and not dying.any():
+            return sites
+
+        parents = sites[dividing]
+        keeps_strand = rng.random(parents.shape) < 0.5
+        hemimethylated_in_first = (parents == METHYLATED) | ((parents == HEMIMETHYLATED) & keeps_strand)
+        hemimethylated_in_second = (parents == METHYLATED) | ((parents == HEMIMETHYLATED) & ~keeps_strand)
+        sites[dividing] = hemimethylated_in_first.astype(np.uint8) * HEMIMETHYLATED
+        second_daughters = hemimethylated_in_second.astype(np.uint8) * HEMIMETHYLATED
+        return np.concatenate([sites[~dying], second_daughters])
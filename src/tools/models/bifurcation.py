@@ -0,0 +1,159 @@
+"""
+This module locates the equilibria of a mean-field approximation of the PDMP, and follows them along a parameter.
+
+Divisions happen at rate b and each one applies the linear split map. Replacing the random divisions by their
+expected effect gives a deterministic flow of the reduced state y = (m, h),
+    dy/dt = F(y) = f(y) + b (split(y) - y),  split(m, h) = (0, m + h / 2).
+Its equilibria are cheap to find with a few Newton solves, but they are a property of the approximation,
+not of the PDMP: the fluctuations from random division times are ignored. For example F has two stable
+equilibria for BISTABLE_PDMP_PARAMS, while simulated trajectories lose the methylated class (mean m is
+about 0.21 at t = 100). Use TransferOperator or exploration.get_bistability_statistics for the PDMP itself.
+"""
+
+import numpy as np
+
+from src.tools.models.pdmp import PDMP
+
+_SPLIT_JACOBIAN = np.array([[0, 0], [1, 0.5]])
+
+
+def get_mean_field_flow(parameters):
+    """Returns the functions y -> F(y) and y -> dF/dy of the mean-field flow on (N, 2) arrays of (m, h)."""
+    flow = PDMP.reduced_flow(parameters)
+    jacobian = PDMP.reduced_jacobian(parameters)
+    birth_rate = parameters["b"]
+    def mean_field_flow(y):
+        # the split map is linear, so it is its own Jacobian
+        return flow(0, y) + birth_rate * (y @ _SPLIT_JACOBIAN.T - y)
+    def mean_field_jacobian(y):
+        return jacobian(0, y) + birth_rate * (_SPLIT_JACOBIAN - np.eye(2))
+    return mean_field_flow, mean_field_jacobian
+
+
+def find_equilibria(parameters, grid_count=20, tolerance=1e-10, max_iterations=50):
+    """
+    Returns the equilibria of the mean-field flow in the simplex, sorted by methylation level 2m + h,
+    as dictionaries with the state (m, h, u), the eigenvalues of the Jacobian and whether the equilibrium is stable.
+    Newton's method is run at once from an even grid of grid_count by grid_count starts over the simplex,
+    and starts that meet a singular Jacobian are dropped.
+    """
+    mean_field_flow, mean_field_jacobian = get_mean_field_flow(parameters)
+    m, h = np.meshgrid(np.linspace(0, 1, grid_count), np.linspace(0, 1, grid_count))
+    inside = m + h <= 1
+    y = np.stack([m[inside], h[inside]], axis=1)
+    for _ in range(max_iterations):
+        y = y - _solve_nonsingular(mean_field_jacobian(y), mean_field_flow(y))
+        y[~np.isfinite(y).all(axis=1)] = np.nan
+    residuals = np.abs(mean_field_flow(y)).max(axis=1)
+    converged = y[(residuals < tolerance) & (y.min(axis=1) > -1e-8) & (y.sum(axis=1) < 1 + 1e-8)]
+
+    equilibria = []
+    for point in converged[np.argsort(2 * converged[:, 0] + converged[:, 1])]:
+        if equilibria and np.allclose(point, equilibria[-1]["state"][:2], atol=1e-7):
+            continue
+        eigenvalues = np.linalg.eigvals(mean_field_jacobian(point[None, :])[0])
+        equilibria.append({
+            "state": PDMP.expand_states(point),
+            "eigenvalues": eigenvalues,
+            "stable": bool(np.all(np.real(eigenvalues) < 0)),
+        })
+    return equilibria
+
+
+def is_mean_field_bistable(parameters):
+    """Whether the mean-field flow has at least two stable equilibria in the simplex (see the module docstring)."""
+    return sum(equilibrium["stable"] for equilibrium in find_equilibria(parameters)) >= 2
+
+
+def continue_equilibrium(parameters, name, start_state, end_value, step=0.01, max_steps=10000,
+                         tolerance=1e-10):
+    """
+    Follows the branch of equilibria through the equilibrium near start_state (m, h, ...) as parameter name
+    moves from parameters[name] toward end_value, by pseudo-arclength continuation, so the branch is followed
+    around folds. Returns a dictionary of arrays "parameter", "state" (rows (m, h, u)) and "stable",
+    with arclength at most step between entries, stopping when the parameter leaves the range
+    or the branch leaves the simplex.
+    """
+    parameters = dict(parameters)
+    start_value = parameters[name]
+    direction = np.sign(end_value - start_value)
+    low, high = sorted([start_value, end_value])
+
+    def residual(point):
+        parameters[name] = point[2]
+        return get_mean_field_flow(parameters)[0](point[None, :2])[0]
+
+    def extended_jacobian(point):
+        # derivative in the parameter by central differences, the rest exactly
+        parameters[name] = point[2]
+        jacobian = get_mean_field_flow(parameters)[1](point[None, :2])[0]
+        delta = 1e-6 * max(1, abs(point[2]))
+        derivative = (residual(point + [0, 0, delta]) - residual(point - [0, 0, delta])) / (2 * delta)
+        return np.column_stack([jacobian, derivative])
+
+    point = _correct(residual, extended_jacobian, np.append(np.asarray(start_state, dtype=float)[:2], start_value),
+                     None, tolerance)
+    tangent = np.array([0, 0, direction])
+    points = []
+    current_step = step
+    while point is not None and low - 1e-12 <= point[2] <= high + 1e-12 and len(points) < max_steps:
+        if point[:2].min() < -1e-8 or point[:2].sum() > 1 + 1e-8:
+            break
+        points.append(point)
+        tangent = _get_tangent(extended_jacobian(point), tangent)
+        point = None
+        # near folds the branch turns quickly, so steps are halved until the corrector converges
+        while point is None and current_step > step * 1e-6:
+            point = _correct(residual, extended_jacobian, points[-1] + current_step * tangent, tangent, tolerance)
+            if point is None:
+                current_step /= 2
+        current_step = min(2 * current_step, step)
+
+    points = np.array(points).reshape(-1, 3)
+    stable = []
+    for point in points:
+        parameters[name] = point[2]
+        eigenvalues = np.linalg.eigvals(get_mean_field_flow(parameters)[1](point[None, :2])[0])
+        stable.append(bool(np.all(np.real(eigenvalues) < 0)))
+    return {"parameter": points[:, 2], "state": PDMP.expand_states(points[:, :2]), "stable": np.array(stable, dtype=bool)}
+
+
+def _solve_nonsingular(matrices, vectors):
+    """Returns the solutions x of matrices[i] x = vectors[i], with rows of nan where the matrix is singular."""
+    solutions = np.full(vectors.shape, np.nan)
+    # nan determinants, from starts dropped earlier, count as singular
+    with np.errstate(invalid="ignore"):
+        solvable = np.abs(np.linalg.det(matrices)) > 0
+    solutions[solvable] = np.linalg.solve(matrices[solvable], vectors[solvable, :, None])[:, :, 0]
+    return solutions
+
+
+def _get_tangent(extended_jacobian, previous):
+    """Returns the unit null vector of the 2 by 3 extended Jacobian, oriented along previous."""
+    tangent = np.linalg.svd(extended_jacobian)[2][-1]
+    return tangent if tangent @ previous >= 0 else -tangent
+
+
+def _correct(residual, extended_jacobian, point, tangent, tolerance, max_iterations=20):
+    """
+    Returns the equilibrium reached by Newton's method from point, keeping the parameter fixed if tangent is None
+    and otherwise staying on the hyperplane through point orthogonal to tangent. Returns None without convergence.
+    """
+    predicted = point.copy()
+    for _ in range(max_iterations):
+        value = residual(point)
+        jacobian = extended_jacobian(point)
+        try:
+            if tangent is None:
+                point = point - np.append(np.linalg.solve(jacobian[:, :2], value), 0)
+            else:
+                system = np.vstack([jacobian, tangent])
+                point = point - np.linalg.solve(system, np.append(value, tangent @ (point - predicted)))
+        except np.linalg.LinAlgError:
+            return None
+        if not np.isfinite(point).all():
+            # nearly singular systems give steps that overflow
+            return None
+        if np.abs(residual(point)).max() < tolerance:
+            return point
+    return None
@@ -0,0 +1,150 @@
+"""
+This module explores the PDMP parameter space in bulk.
+
+Parameter sets are sampled by Latin hypercube or Sobol designs (or plain uniforms), and chunks of them run
+in a pool of processes, each chunk as one batch with a parameter set per row. Workers reduce their trajectories
+to a few statistics of the time spent above a methylation threshold, so only one short row per parameter set
+comes back, and rows are appended to a csv file in io's exploration folder as chunks finish.
+"""
+
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.stats import qmc
+
+from src.tools import io
+from src.tools.models import bifurcation
+from src.tools.models.pdmp import PDMP
+
+# the ranges explore_parameters.py used to sample, a number fixes a parameter
+PARAMETER_RANGES = {
+    'b': 1,
+    'r_uh': (0, 1),
+    'r_hm': (0, 1),
+    'r_mh': (0, 1),
+    'r_hu': (0, 1),
+    'r_uh_h': (0, 10),
+    'r_uh_m': (0, 10),
+    'r_hm_h': (0, 10),
+    'r_hm_m': (0, 10),
+    'r_mh_h': (0, 10),
+    'r_mh_u': (0, 10),
+    'r_hu_h': (0, 10),
+    'r_hu_u': (0, 10),
+}
+
+STATISTICS = ["mean_field_stable_equilibria", "methylated_fraction", "switch_count", "r_um", "r_mu"]
+
+
+def sample_parameters(count, ranges=None, method="sobol", seed=None):
+    """
+    Returns count parameter sets with each varying parameter spread over its (low, high) range in ranges
+    (by default PARAMETER_RANGES), by a scrambled "sobol" sequence, a "latin" hypercube or "random" uniforms.
+    """
+    if ranges is None:
+        ranges = PARAMETER_RANGES
+    names = [name for name, value in ranges.items() if not np.isscalar(value)]
+    if seed is None:
+        seed = random.getrandbits(64)
+    if method == "sobol":
+        points = qmc.Sobol(len(names), seed=seed).random(count)
+    elif method == "latin":
+        points = qmc.LatinHypercube(len(names), seed=seed).random(count)
+    elif method == "random":
+        points = np.random.default_rng(seed).random((count, len(names)))
+    else:
+        raise ValueError(f"Unknown sampling method {method}")
+    lows = np.array([ranges[name][0] for name in names])
+    highs = np.array([ranges[name][1] for name in names])
+    values = qmc.scale(points, lows, highs) if names else points
+    fixed = {name: value for name, value in ranges.items() if np.isscalar(value)}
+    return [{**fixed, **dict(zip(names, map(float, row)))} for row in values]
+
+
+def get_bistability_statistics(times, methylated, threshold=0.6, tolerance=2):
+    """
+    Returns a dictionary of arrays with the time fraction each row of the (N, T) array methylated (m at times)
+    spends in the methylated class, the number of switches between classes and the rates r_um and r_mu of
+    switching out of each class per unit time spent in it (nan without time spent in the class).
+    A row is methylated while m > threshold, ignoring dips shorter than tolerance and then
+    methylated stretches shorter than 5 tolerance, like the old log analysis of explore_parameters.py.
+    """
+    times = np.asarray(times, dtype=float)
+    high = np.asarray(methylated) > threshold
+    high = _drop_short_runs(times, high, False, tolerance)
+    high = _drop_short_runs(times, high, True, 5 * tolerance)
+    durations = np.append(np.diff(times), 0)
+    time_in_m = (high * durations).sum(axis=1)
+    time_in_u = times[-1] - times[0] - time_in_m
+    ups = (~high[:, :-1] & high[:, 1:]).sum(axis=1)
+    downs = (high[:, :-1] & ~high[:, 1:]).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "methylated_fraction": time_in_m / (times[-1] - times[0]),
+            "switch_count": ups + downs,
+            "r_um": np.where(time_in_u > 0, ups / time_in_u, np.nan),
+            "r_mu": np.where(time_in_m > 0, downs / time_in_m, np.nan),
+        }
+
+
+def explore(parameter_sets, filename, times, initial_state=(0, 0, 1), chunk_size=50, worker_count=None,
+            threshold=0.6, tolerance=2, seed=None, resume=False):
+    """
+    Runs one trajectory per parameter set from initial_state and writes one row per set to filename,
+    with the parameters, the number of stable equilibria of the mean-field flow (see bifurcation)
+    and get_bistability_statistics.
+    Chunks of chunk_size sets run as batches in worker_count processes (by default one per core).
+    An existing file of the same name is replaced, unless resume is set, in which case the sets already
+    in it are skipped (with the same parameter_sets, chunk_size and seed the result matches one full run).
+    Returns the number of rows written.
+    """
+    names = list(parameter_sets[0].keys())
+    seeds = np.random.SeedSequence(random.getrandbits(64) if seed is None else seed)
+    chunks = [parameter_sets[start:start + chunk_size] for start in range(0, len(parameter_sets), chunk_size)]
+    tasks = [(chunk, names, list(initial_state), list(times), threshold, tolerance, child)
+             for chunk, child in zip(chunks, seeds.spawn(len(chunks)))]
+    if resume and io.has_exploration(filename):
+        done_count = len(io.read_exploration(filename)[names[0]])
+        if done_count % chunk_size != 0 and done_count != len(parameter_sets):
+            raise ValueError(f"{filename} holds {done_count} rows, which is not a whole number of chunks")
+        tasks = tasks[(done_count + chunk_size - 1) // chunk_size:]
+    else:
+        io.start_exploration(names + STATISTICS, filename)
+    row_count = 0
+    with ProcessPoolExecutor(worker_count or os.cpu_count()) as executor:
+        for rows in executor.map(_explore_task, tasks):
+            io.append_exploration_rows(rows, filename)
+            row_count += len(rows)
+    return row_count
+
+
+def _explore_task(task):
+    parameter_sets, names, initial_state, times, threshold, tolerance, seed = task
+    data = PDMP().generate_batch_timepoint_data(parameter_sets, [initial_state] * len(parameter_sets), times,
+                                                rng=np.random.default_rng(seed), reduced=True)
+    statistics = get_bistability_statistics(times, data[:, :, 0], threshold, tolerance)
+    stable_counts = [sum(equilibrium["stable"] for equilibrium in bifurcation.find_equilibria(parameters))
+                     for parameters in parameter_sets]
+    return [[parameters[name] for name in names] + [stable_count] + [statistics[name][i] for name in STATISTICS[1:]]
+            for i, (parameters, stable_count) in enumerate(zip(parameter_sets, stable_counts))]
+
+
+def _drop_short_runs(times, classes, value, min_duration):
+    """Returns classes (an (N, T) boolean array) with the runs of value lasting less than min_duration flipped,
+    except the runs at the start and end of each row."""
+    row_count, time_count = classes.shape
+    starts = np.ones(classes.shape, dtype=bool)
+    starts[:, 1:] = classes[:, 1:] != classes[:, :-1]
+    flat_starts = np.flatnonzero(starts)
+    flat_ends = np.append(flat_starts[1:], row_count * time_count)
+    start_columns = flat_starts % time_count
+    # a run ends at the next run's start in the same row, or at the end of the row
+    ends_row = flat_ends // time_count != flat_starts // time_count
+    end_columns = np.where(ends_row, time_count - 1, flat_ends % time_count)
+    durations = times[end_columns] - times[start_columns]
+    run_values = classes.ravel()[flat_starts]
+    flipped = (run_values == value) & (durations < min_duration) & (start_columns > 0) & ~ends_row
+    lengths = np.diff(np.append(flat_starts, row_count * time_count))
+    return (classes.ravel() ^ np.repeat(flipped, lengths)).reshape(classes.shape)
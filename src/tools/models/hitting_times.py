@@ -0,0 +1,66 @@
+"""
+This module contains tables of hitting times of the PDMP flow, which answer
+(start, level) queries by interpolation instead of a new integration each time.
+"""
+
+import numpy as np
+
+
+class HittingTimeTable:
+    """
+    Times for the PDMP flow from [0, start, 1 - start] to first reach 2m + h = level,
+    tabulated on increasing grids of starts (in [0, 1]) and levels (in [0, 2]).
+    times[i, j] is 0 when levels[j] <= starts[i] and infinite when the level is never reached.
+    """
+
+    def __init__(self, starts, levels, times):
+        self.starts = np.asarray(starts, dtype=float)
+        self.levels = np.asarray(levels, dtype=float)
+        self.times = np.asarray(times, dtype=float)
+
+    @classmethod
+    def from_trajectories(cls, starts, levels, times, values):
+        """
+        Builds the table from trajectories sampled at the given times, where values[i, k]
+        is 2m + h at times[k] on the trajectory from starts[i].
+        A level is first reached where the running maximum of the values passes it,
+        which is found by linear interpolation between the two samples around the crossing.
+        """
+        levels = np.asarray(levels, dtype=float)
+        running_max = np.maximum.accumulate(values, axis=1)
+        table = np.full((len(starts), len(levels)), np.inf)
+        for i, maxima in enumerate(running_max):
+            after = np.searchsorted(maxima, levels)
+            reached = after < len(times)
+            before = np.maximum(after[reached] - 1, 0)
+            after = after[reached]
+            rise = maxima[after] - maxima[before]
+            fractions = np.divide(levels[reached] - maxima[before], rise, out=np.ones_like(rise), where=rise > 0)
+            table[i, reached] = times[before] + fractions * (times[after] - times[before])
+            table[i, levels <= maxima[0]] = 0
+        return cls(starts, levels, table)
+
+    def __call__(self, starts, levels):
+        """Returns the hitting times for the (broadcast) arrays of starts and levels by bilinear interpolation.
+        Queries next to an unreachable level are infinite."""
+        starts, levels = np.broadcast_arrays(np.asarray(starts, dtype=float), np.asarray(levels, dtype=float))
+        i = np.clip(np.searchsorted(self.starts, starts, side="right") - 1, 0, len(self.starts) - 2)
+        j = np.clip(np.searchsorted(self.levels, levels, side="right") - 1, 0, len(self.levels) - 2)
+        s = np.clip((starts - self.starts[i]) / (self.starts[i + 1] - self.starts[i]), 0, 1)
+        t = np.clip((levels - self.levels[j]) / (self.levels[j + 1] - self.levels[j]), 0, 1)
+        corners = [self.times[i, j], self.times[i + 1, j], self.times[i, j + 1], self.times[i + 1, j + 1]]
+        weights = [(1 - s) * (1 - t), s * (1 - t), (1 - s) * t, s * t]
+        # weights of zero must not turn infinite corners into nan
+        result = sum(np.where(weight > 0, weight * np.where(np.isinf(corner), 0, corner), 0)
+                     for weight, corner in zip(weights, corners))
+        infinite = np.any([np.isinf(corner) & (weight > 0) for weight, corner in zip(weights, corners)], axis=0)
+        result = np.where(infinite, np.inf, result)
+        # a start at or above the level has already hit it
+        return np.where(levels <= starts, 0.0, result)
+
+    def to_arrays(self):
+        return {"starts": self.starts, "levels": self.levels, "times": self.times}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays["starts"], arrays["levels"], arrays["times"])
@@ -6,18 +6,26 @@ In particular, we instantiate:
     to simulate a fitness landscape.
 """
 
+import heapq
 import math
 import random
-import copy 
 
 import numpy as np
-from scipy.integrate import odeint
-from scipy.optimize import root, minimize
+from scipy.linalg import expm
+from scipy.optimize import minimize
+from scipy import optimize
+from scipy.sparse import coo_matrix
+from scipy.stats import binom
+
+from src.constants import CONVERGENCE_TOLERANCE
 
 from src.tools.models.event import (ConstantEvent, ConstantEventModel, TimeIndependentEvent,
                                     EventModel)
+from src.tools.models.flow import FlowMap
 from src.tools.models.homogeneous import IndependentBirth, IndependentDeath, IndependentModel, IndependentSwitch
 from src.tools.models.model import Model
+from src.tools.models.population import PopulationModel, SparseExponentialPopulationModel
+from src.tools.models.rng import get_numpy_generator
 
 
 # Events used by the one dimensional models
@@ -149,7 +157,7 @@ class OneDimensionalNonCollaborative(IndependentModel):
 
         def r_d(x, parameters):
             return x * parameters["d_M"] + (1 - x) * parameters["d_0"]
-        model = InfiniteSiteOneDimensional(r_b, r_d, r_um, r_mu)
+        model = InfiniteSiteOneDimensional(r_b, r_d, r_um, r_mu, constant_rates=True)
         return model
 
 
@@ -193,6 +201,8 @@ class SingleSite(ConstantEventModel):
 # Model to describe behavior of a single lineage
 
 class BirthShift(TimeIndependentEvent):
+    """At division, methylated sites become hemimethylated and each hemimethylated site
+    keeps its methylated strand with probability 1/2 (otherwise it becomes unmethylated)."""
     def get_max_rate(self, state, model_parameters):
         return model_parameters["b"]
     
@@ -201,10 +211,8 @@ class BirthShift(TimeIndependentEvent):
         h = state[1]
         m = state[2]
 
-        x = 0
-        for _ in range(h):
-            if random.random() > 0.5:
-                x += 1
+        # binomial(h, 1/2) in a single draw: count the set bits of h random bits
+        x = random.getrandbits(h).bit_count()
 
         state[0] = u + x
         state[1] = m + h - x
@@ -213,19 +221,327 @@ class BirthShift(TimeIndependentEvent):
 
 class NoncollaborativeSingleCell(EventModel):
     """The state space is (N_u, N_h, N_m) | N_u + N_h + N_m = M.
-    This is a linear model where individuals are CpG sites."""
+    This is a linear model where individuals are CpG sites.
+
+    Since sites are independent between divisions, the counts after a time dt are
+    a sum of multinomial draws from the rows of the site transition matrix expm(Q dt).
+    The site generator Q is computed once per parameter set, and the divisions are
+    drawn as a Poisson process, so runs cost a handful of draws per division
+    instead of one Gillespie step per site switch."""
 
 
     name = "Single Cell Noncollaborative Model"
 
     def __init__(self):
         events = []
-        events.append(IndependentSwitch(0, 1, "r_uh"))
-        events.append(IndependentSwitch(1, 0, "r_hu"))
-        events.append(IndependentSwitch(1, 2, "r_hm"))
-        events.append(IndependentSwitch(2, 1, "r_mh"))
-        events.append(BirthShift("b"))
+        events.append(IndependentSwitch(0, 1, lambda x : x["r_uh"]))
+        events.append(IndependentSwitch(1, 0, lambda x : x["r_hu"]))
+        events.append(IndependentSwitch(1, 2, lambda x : x["r_hm"]))
+        events.append(IndependentSwitch(2, 1, lambda x : x["r_mh"]))
+        events.append(BirthShift())
         super().__init__(events)
+        self._site_generators = {}
+
+    def run(self, parameters, initial_state, duration):
+        return [int(n) for n in self.run_batch(parameters, [initial_state], duration)[0]]
+
+    def run_batch(self, parameters, initial_states, duration, rng=None):
+        """Runs every row of initial_states (an (N, 3) array of counts) independently for duration.
+        Returns the (N, 3) array of end states."""
+        return self.generate_batch_timepoint_data(parameters, initial_states, [duration], rng=rng)[:, -1]
+
+    def generate_batch_timepoint_data(self, parameters, initial_states, times, rng=None):
+        """Returns an (N, T, 3) array with the state of each of the N cells at each of the T times.
+        Times must be sorted and nonnegative; cells are independent."""
+        if rng is None:
+            rng = get_numpy_generator()
+        states = np.array(initial_states, dtype=np.int64).reshape(-1, 3)
+        cell_count = len(states)
+        generator = self._get_site_generator(parameters)
+        birth_rate = parameters["b"]
+
+        result = np.empty((cell_count, len(times), 3), dtype=np.int64)
+        cell_times = np.zeros(cell_count)
+        next_splits = self._draw_waiting_times(rng, birth_rate, cell_count)
+        for i, time in enumerate(times):
+            # split every cell whose next division comes before the timepoint
+            while True:
+                splitting = np.flatnonzero(next_splits <= time)
+                if len(splitting) == 0:
+                    break
+                split_times = next_splits[splitting]
+                states[splitting] = self._switch_sites(
+                    rng, states[splitting], expm(generator * (split_times - cell_times[splitting])[:, None, None]))
+                states[splitting] = self._split(rng, states[splitting])
+                cell_times[splitting] = split_times
+                next_splits[splitting] = split_times + self._draw_waiting_times(rng, birth_rate, len(splitting))
+
+            # cells which did not split since the last timepoint share the same step
+            steps, step_indices = np.unique(time - cell_times, return_inverse=True)
+            transitions = expm(generator * steps[:, None, None])
+            states = self._switch_sites(rng, states, transitions[step_indices])
+            cell_times[:] = time
+            result[:, i] = states
+        return result
+
+    def generate_simulation_data(self, parameters, initial_state, timepoints, sample_count=1):
+        """Same output as Model.generate_simulation_data, but all samples run as one batch."""
+        times = [0] + list(timepoints)
+        initial_states = np.tile(np.array(initial_state, dtype=np.int64), (sample_count, 1))
+        data = self.generate_batch_timepoint_data(parameters, initial_states, times)
+        simulation_result = {
+            "parameters": parameters,
+            "model": self.name,
+            "data": [],
+            "timepoints": timepoints
+        }
+        for sample in data:
+            timepoint_data = {time: [int(n) for n in state] for time, state in zip(times, sample)}
+            timepoint_data[0] = list(initial_state)
+            simulation_result["data"].append(timepoint_data)
+        return simulation_result
+
+    def _get_site_generator(self, parameters):
+        """Returns the generator of a single site on the states (u, h, m), cached per parameter set."""
+        key = (parameters["r_uh"], parameters["r_hu"], parameters["r_hm"], parameters["r_mh"])
+        if key not in self._site_generators:
+            r_uh, r_hu, r_hm, r_mh = key
+            self._site_generators[key] = np.array([
+                [-r_uh, r_uh, 0],
+                [r_hu, -r_hu - r_hm, r_hm],
+                [0, r_mh, -r_mh],
+            ], dtype=float)
+        return self._site_generators[key]
+
+    @staticmethod
+    def _switch_sites(rng, states, transition):
+        """Moves each site to a new state according to the site transition matrix (or one per cell)."""
+        probabilities = np.clip(np.broadcast_to(transition, (len(states), 3, 3)), 0, None)
+        probabilities = probabilities / probabilities.sum(axis=2, keepdims=True)
+        new_states = np.zeros_like(states)
+        for site_state in range(3):
+            new_states += rng.multinomial(states[:, site_state], probabilities[:, site_state])
+        return new_states
+
+    @staticmethod
+    def _split(rng, states):
+        kept = rng.binomial(states[:, 1], 0.5)
+        return np.stack([states[:, 0] + kept, states[:, 2] + states[:, 1] - kept, np.zeros_like(kept)], axis=1)
+
+    @staticmethod
+    def _draw_waiting_times(rng, rate, count):
+        if rate == 0:
+            return np.full(count, np.inf)
+        return rng.exponential(1 / rate, count)
+
+
+# Model to describe populations of cells whose type is the full site state (N_u, N_h, N_m)
+
+def get_site_switch_rates(parameters, u, h, m, site_count):
+    """
+    Returns the per-site rates (u->h, h->u, h->m, m->h) for cells with u, h and m sites 
+    in each state. Works elementwise on arrays of counts.
+
+    Collaborative contributions are proportional to the fraction of sites in the mediating state,
+    so that quasi-steady-state reduction recovers the rates of the one dimensional collaborative events.
+    """
+    M = site_count
+    r_uh = parameters["r_uh"] + (parameters["r_uh_h"] * h + parameters["r_uh_m"] * m) / M
+    r_hu = parameters["r_hu"] + (parameters["r_hu_h"] * h + parameters["r_hu_u"] * u) / M
+    r_hm = parameters["r_hm"] + (parameters["r_hm_h"] * h + parameters["r_hm_m"] * m) / M
+    r_mh = parameters["r_mh"] + (parameters["r_mh_h"] * h + parameters["r_mh_u"] * u) / M
+    return r_uh, r_hu, r_hm, r_mh
+
+
+def get_methylation_level(h, m, site_count):
+    """Fraction of methylated CpG strands. Hemimethylated sites count for half."""
+    return (2 * m + h) / (2 * site_count)
+
+
+class SiteStateCollaborative(PopulationModel):
+    """
+    Multitype branching process whose types are the (M+1)(M+2)/2 site states (N_u, N_h, N_m).
+        - Each site switches u <-> h <-> m at collaborative rates (see get_site_switch_rates).
+        - Birth and death rates vary linearly with the methylation level (see get_methylation_level).
+        - At birth, methylated sites become hemimethylated in both daughters, and each hemimethylated
+          site is hemimethylated in one daughter and unmethylated in the other.
+
+    States may be given densely (a list indexed like self.types) or sparsely as a dictionary 
+    {(N_u, N_h, N_m): count}; runs return states in the form they were given.
+    Simulation only ever touches occupied types, rates are tabulated once per parameter set, 
+    and the mean generator is a sparse matrix.
+    """
+    name = "Site-State Collaborative Methylation with Linear Fitness"
+
+    def __init__(self, M: int):
+        self.site_count = M
+        self.types = [(M - h - m, h, m) for m in range(M + 1) for h in range(M + 1 - m)]
+        self.type_indices = {cell_type: i for i, cell_type in enumerate(self.types)}
+        super().__init__(len(self.types))
+        self.population_count = self.num_of_populations
+        self.name = f"{self.name} ({M} sites)"
+        self._rate_tables = {}
+
+        types = np.array(self.types)
+        self._u, self._h, self._m = types[:, 0], types[:, 1], types[:, 2]
+
+        # type reached by each switch (u->h, h->u, h->m, m->h), or -1 if impossible
+        moves = [(-1, 1, 0), (1, -1, 0), (0, -1, 1), (0, 1, -1)]
+        self._switch_targets = np.array([[self.type_indices.get((u + du, h + dh, m + dm), -1)
+                                          for du, dh, dm in moves] for u, h, m in self.types])
+
+        # daughter pairs: x of the h hemimethylated sites stay hemimethylated in daughter A
+        owners, probabilities, daughters_a, daughters_b = [], [], [], []
+        for i, (u, h, m) in enumerate(self.types):
+            xs = np.arange(h + 1)
+            owners.append(np.full(h + 1, i))
+            probabilities.append(binom.pmf(xs, h, 0.5))
+            daughters_a.append([self.type_indices[(u + h - x, m + x, 0)] for x in xs])
+            daughters_b.append([self.type_indices[(u + x, m + h - x, 0)] for x in xs])
+        self._split_owners = np.concatenate(owners)
+        self._split_probabilities = np.concatenate(probabilities)
+        self._split_daughters_a = np.concatenate(daughters_a)
+        self._split_daughters_b = np.concatenate(daughters_b)
+
+    def run(self, parameters, initial_state, duration, max_num_steps=None):
+        """Gillespie simulation over the occupied types. Does not mutate initial_state."""
+        is_dense = not isinstance(initial_state, dict)
+        if is_dense:
+            counts = {i: count for i, count in enumerate(initial_state) if count > 0}
+        else:
+            counts = {self.type_indices[tuple(cell_type)]: count 
+                      for cell_type, count in initial_state.items() if count > 0}
+        birth, death, switches, total = self._get_rate_tables(parameters)
+
+        current_time = 0
+        num_steps = 0
+        while counts:
+            num_steps += 1
+            if max_num_steps is not None and num_steps > max_num_steps:
+                raise RuntimeError(
+                    "Maximum number of steps for single simulation exceeded")
+            indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            weights = np.fromiter(counts.values(), dtype=float, count=len(counts)) * total[indices]
+            cumulative = np.cumsum(weights)
+            total_rate = cumulative[-1]
+            if total_rate == 0:
+                break
+            current_time += - math.log(random.random()) / total_rate
+            if current_time > duration:
+                break
+
+            position = min(np.searchsorted(cumulative, random.random() * total_rate, side="right"), 
+                           len(indices) - 1)
+            index = int(indices[position])
+            self._remove_cell(counts, index)
+
+            event_rng = random.random() * total[index]
+            if event_rng < birth[index]:
+                u, h, m = self.types[index]
+                x = random.getrandbits(h).bit_count()
+                self._add_cell(counts, self.type_indices[(u + h - x, m + x, 0)])
+                self._add_cell(counts, self.type_indices[(u + x, m + h - x, 0)])
+                continue
+            event_rng -= birth[index]
+            if event_rng < death[index]:
+                continue
+            event_rng -= death[index]
+            for target, rate in zip(self._switch_targets[index], switches[index]):
+                if event_rng < rate:
+                    break
+                event_rng -= rate
+            else:
+                # rounding left event_rng past the last rate: take the last possible event (a death without switches)
+                possible = self._switch_targets[index][switches[index] > 0]
+                if len(possible) == 0:
+                    continue
+                target = possible[-1]
+            self._add_cell(counts, int(target))
+
+        if is_dense:
+            state = [0] * self.population_count
+            for index, count in counts.items():
+                state[index] = count
+            return state
+        return {self.types[index]: count for index, count in counts.items()}
+
+    def get_deterministic_model(self) -> SparseExponentialPopulationModel:
+        """Returns the the model which outputs the mean behavior (on dense states)"""
+        model = SparseExponentialPopulationModel(
+            self.population_count, self._calculate_generator)
+        model.name = f"{self.name} (deterministic)"
+        return model
+
+    def calculate_extinction(self, parameters: dict):
+        """
+        Calculates the extinction probabilities by iterating the first-step conditioning equation
+            q_i = (d_i + sum_j r_ij q_j + b_i E[q_A q_B]) / total_i
+        where A, B are the (correlated) daughter types, vectorized over all types.
+        """
+        birth, death, switches, total = self._get_rate_tables(parameters)
+        # impossible switches have rate 0 and point at an arbitrary valid type
+        targets = np.where(self._switch_targets < 0, 0, self._switch_targets)
+        split_weights = self._split_probabilities * birth[self._split_owners]
+
+        def recursive_extinction_function(guess):
+            new_guess = death + (switches * guess[targets]).sum(axis=1)
+            new_guess = new_guess + np.bincount(
+                self._split_owners, 
+                weights=split_weights * guess[self._split_daughters_a] * guess[self._split_daughters_b],
+                minlength=self.population_count)
+            return np.divide(new_guess, total, out=np.ones_like(new_guess), where=total > 0)
+
+        initial_guess = np.array([0.5] * self.population_count)
+        return optimize.fixed_point(recursive_extinction_function, initial_guess,
+                                    maxiter=50000, method="iteration", xtol=CONVERGENCE_TOLERANCE)
+
+    def to_dense(self, state: dict) -> list:
+        dense_state = [0] * self.population_count
+        for cell_type, count in state.items():
+            dense_state[self.type_indices[tuple(cell_type)]] += count
+        return dense_state
+
+    def to_sparse(self, state) -> dict:
+        return {self.types[i]: count for i, count in enumerate(state) if count != 0}
+
+    def _get_rate_tables(self, parameters):
+        """Returns per-type (birth, death, switches, total) rate arrays, cached per parameter set."""
+        key = tuple(sorted(parameters.items()))
+        if key not in self._rate_tables:
+            level = get_methylation_level(self._h, self._m, self.site_count)
+            birth = parameters["b_0"] * (1 - level) + parameters["b_M"] * level
+            death = parameters["d_0"] * (1 - level) + parameters["d_M"] * level
+            r_uh, r_hu, r_hm, r_mh = get_site_switch_rates(
+                parameters, self._u, self._h, self._m, self.site_count)
+            switches = np.stack([r_uh * self._u, r_hu * self._h, r_hm * self._h, r_mh * self._m], axis=1)
+            switches[self._switch_targets < 0] = 0
+            total = birth + death + switches.sum(axis=1)
+            self._rate_tables[key] = (birth, death, switches, total)
+        return self._rate_tables[key]
+
+    def _calculate_generator(self, parameters: dict):
+        birth, _, switches, total = self._get_rate_tables(parameters)
+        n = self.population_count
+        possible = self._switch_targets >= 0
+        switch_rows = np.nonzero(possible)[0]
+        rows = np.concatenate([np.arange(n), switch_rows, self._split_owners, self._split_owners])
+        columns = np.concatenate([np.arange(n), self._switch_targets[possible],
+                                  self._split_daughters_a, self._split_daughters_b])
+        # birth removes the parent (counted in -total) and contributes to both daughters
+        split_rates = birth[self._split_owners] * self._split_probabilities
+        values = np.concatenate([-total, switches[possible], split_rates, split_rates])
+        return coo_matrix((values, (rows, columns)), shape=(n, n)).tocsr()
+
+    @staticmethod
+    def _add_cell(counts, index):
+        counts[index] = counts.get(index, 0) + 1
+
+    @staticmethod
+    def _remove_cell(counts, index):
+        if counts[index] == 1:
+            del counts[index]
+        else:
+            counts[index] -= 1
 
 
 # Model to describe branching process where cells have continuous type and deterministic
@@ -238,128 +554,324 @@ class BranchingDiffusion(Model):
         self._r_b = r_b # birth rate
         self._r_d = r_d # death rate
         self.diffusion = diffusion # change in x
+        self._rate_maxima = {}
+        self._flow_maps = {}
+
+    def calculate_extinction(self, parameters, point_count=1001, initial_guess=None):
+        """Returns the extinction probabilities at the point_count equally spaced types of [0, 1]."""
+        extinction = self.solve_extinction(parameters, initial_guess=initial_guess)
+        return extinction(np.linspace(0, 1, point_count)).tolist()
+
+    def solve_extinction(self, parameters, degree=64, initial_guess=None, tolerance=1e-11, max_iterations=100):
+        """
+        Returns the extinction probability y(x) as a Chebyshev interpolant on [0, 1].
+
+        y solves f(x) y' = - (d(x) - b(x) y)(1 - y), which is singular where the diffusion f vanishes.
+        Written as f y' + (d - b y)(1 - y) = 0 and collocated at Chebyshev points, the singular point 
+        needs no special treatment: polynomial solutions are automatically the regular ones.
+        The collocation equations are solved by Newton's method, starting from initial_guess 
+        (a callable, such as the result for nearby parameters) or from min(d / b, 1).
+        """
+        xs, differentiation = _chebyshev_points(degree)
+        f = np.array([self.diffusion(x, parameters) for x in xs])
+        b = np.array([self._r_b(x, parameters) for x in xs])
+        d = np.array([self._r_d(x, parameters) for x in xs])
+        if initial_guess is None:
+            y = np.clip(d / b, 0, 1)
+        else:
+            y = np.array(initial_guess(xs), dtype=float)
+
+        for _ in range(max_iterations):
+            residual = f * (differentiation @ y) + (d - b * y) * (1 - y)
+            jacobian = f[:, None] * differentiation + np.diag(2 * b * y - b - d)
+            step = np.linalg.solve(jacobian, - residual)
+            y = y + step
+            if np.abs(step).max() < tolerance:
+                break
+        else:
+            raise RuntimeError("Extinction collocation did not converge")
+        return np.polynomial.Chebyshev.fit(xs, y, degree, domain=[0, 1])
 
-    def calculate_extinction(self, parameters, point_count=1001):
-        def extinction_derivative(y, x):
-            b = self._r_b(x, parameters)
-            d = self._r_d(x, parameters)
-            diff = self.diffusion(x, parameters)
-            
-            if diff == 0:
-                if y == 1:
-                    return 0
-                """Need to use L'hospital's rule to get a real answer"""
-                return 0
-            return - (d - b * y) * (1 - y) / (diff)
-
-        def diffusion(x):
-            return self.diffusion(x, parameters)
-
-        initial_x = root(diffusion, 0.5).x[0]
-        initial_y = min(self._r_d(initial_x, parameters) /
-                        self._r_b(initial_x, parameters), 1)
-        
-        
-        all_times = [i / (point_count - 1) for i in range(point_count)]
-        low_times = [time for time in all_times if time <
-                     initial_x] + [initial_x]
-        high_times = [initial_x] + \
-            [time for time in all_times if time >= initial_x]    
-        
-        
-        
-        # get probabilities below the stable x
-        low_res = odeint(extinction_derivative, initial_y,
-                         list(reversed(low_times)))
-        
-        # get probabilities above the stable x
-        high_res = odeint(extinction_derivative, initial_y, high_times)
-
-        # combine probabilities into one list
-        res = list(reversed(low_res[:, 0][1:])) + list(high_res[:, 0][1:])
-
-        return res
+    def get_deterministic_model(self, bin_count=200, substep_count=64):
+        """Returns the model which outputs the mean behavior as expected cell counts on bin_count bins of [0, 1]"""
+        model = BranchingDiffusionDensity(self, bin_count, substep_count)
+        return model
 
-    def run(self, parameters:dict, initial_state:dict, duration:float):
-        r_max_b = self._r_b(minimize(lambda x: - self._r_b(x[0], parameters), np.array([1/2]), bounds = [(0, 1)]).x[0], parameters)
-        r_max_d = self._r_d(minimize(lambda x: - self._r_d(x[0], parameters), np.array([1/2]), bounds = [(0, 1)]).x[0], parameters)
+    def flow(self, cell_types, duration, parameters):
+        """Returns the types (an array) that cells of the given types diffuse to after duration.
+        Looks up the flow map, which is precomputed once per parameter set."""
+        return self.get_flow_map(parameters)(cell_types, duration)
+
+    def get_flow_map(self, parameters) -> FlowMap:
+        key = tuple(sorted(parameters.items()))
+        if key not in self._flow_maps:
+            self._flow_maps[key] = FlowMap(lambda x: self.diffusion(x, parameters))
+        return self._flow_maps[key]
+
+    def run(self, parameters:dict, initial_state:dict, duration:float, engine="thinning"):
+        """
+        Simulates births and deaths by thinning at the maximal per-cell rate.
+        The engine is either "thinning" (a global event loop, described below) 
+        or "clock" (per-cell event times, see _run_with_clocks).
         
+        The population is kept as a sorted array of types with an array of counts.
+        Flows of a one dimensional autonomous ODE preserve order, so the arrays stay sorted,
+        and since births copy their parent's type no new entries are ever needed.
+        The firing cell is found in O(log n) through a Fenwick tree over the counts.
+        """
+        if engine == "clock":
+            return self._run_with_clocks(parameters, initial_state, duration)
+        r_max_b, r_max_d = self._get_rate_maxima(parameters)
         r_max_cell = r_max_b + r_max_d
-        
-        def diffusion(x, t) -> float:
-            return self.diffusion(x, parameters)
-        
-        current_state = copy.deepcopy(initial_state)
-        current_time = 0
 
+        cell_types = np.array(sorted(initial_state.keys()), dtype=float)
+        counts = _FenwickTree([initial_state[cell_type] for cell_type in sorted(initial_state.keys())])
+        current_time = 0
 
         while True:
-            cell_count = sum(current_state.values())
+            cell_count = counts.total
             max_rate = r_max_cell * cell_count
             if max_rate == 0:
                 # nothing else happens if nothing is alive
                 break
-            else:
-                diffusing_time = - np.log(random.random()) / max_rate
+            diffusing_time = - np.log(random.random()) / max_rate
             next_life_time = current_time + diffusing_time
-            
-            if next_life_time > duration:
-                # diffuse until the end
-                times = [current_time, duration]
-            else: 
-                # diffuse until the next birth/death
-                times = [current_time, next_life_time]
-            # solve diffusion
-            new_state = {}
-            for cell_type in current_state:
-                next_key = odeint(diffusion, cell_type, times)[1][0]
-                new_state[next_key] = current_state[cell_type]
-            current_state = new_state
-            
+
+            # diffuse until the next birth/death or until the end
+            cell_types = self.flow(cell_types, min(next_life_time, duration) - current_time, parameters)
+
             # end if necessary, update the time otherwise
             if next_life_time > duration:
                 break
             current_time = next_life_time
-            
-            # generate number to determine behavior
-            event_rng = random.random() * max_rate
-            
-            # use number to determine cell
-            event_cell = None
-            for cell_type, cell_count in current_state.items():
-                if cell_count * r_max_cell >= event_rng:
-                    event_cell = cell_type
-                    event_rng = event_rng / cell_count
-                    break
-                event_rng -= cell_count * r_max_cell
-            
+
+            # every cell has the same maximal rate, so the firing cell is uniform
+            index = counts.find(random.random() * cell_count)
+            event_cell = cell_types[index]
+
             # use number to determine if/what event occurrs
-            for i, rate in enumerate([r_max_b, r_max_d]):
-                if event_rng <= rate:
-                    if i == 0:
-                        if event_rng <= self._r_b(event_cell, parameters):
-                            """BIRTH"""
-                            current_state[event_cell] = current_state[event_cell] + 1            
-                    elif i == 1:
-                        if event_rng <= self._r_d(event_cell, parameters):
-                            """DEATH"""
-                            current_state[event_cell] = current_state[event_cell] - 1
-                            if current_state[event_cell] == 0:
-                                del current_state[event_cell] 
-                    break 
-                event_rng -= rate
-            
-            
+            event_rng = random.random() * r_max_cell
+            if event_rng <= r_max_b:
+                if event_rng <= self._r_b(event_cell, parameters):
+                    # BIRTH
+                    counts.add(index, 1)
+            elif event_rng - r_max_b <= self._r_d(event_cell, parameters):
+                # DEATH
+                counts.add(index, -1)
+                if counts.empty_count > len(cell_types) // 2:
+                    cell_types, counts = self._drop_empty_types(cell_types, counts)
+
+        final_state = {}
+        for cell_type, cell_count in zip(cell_types.tolist(), counts.to_list()):
+            if cell_count > 0:
+                final_state[cell_type] = final_state.get(cell_type, 0) + cell_count
+        return final_state
+
+    def _run_with_clocks(self, parameters, initial_state, duration):
+        """
+        A cell's type is a deterministic function of its type at some reference time and its age since then.
+        So each cell keeps (reference type, reference time) and its own next candidate event time
+        in a priority queue, and its type is only computed when it fires.
+        Each event costs O(log n) regardless of how many distinct types exist.
+        The slots of dead cells are reused by later births, so the lists only grow with the live population.
+        """
+        r_max_b, r_max_d = self._get_rate_maxima(parameters)
+        r_max_cell = r_max_b + r_max_d
 
-        return current_state
-    
+        reference_types = []
+        reference_times = []
+        free_slots = []
+        queue = []
+        for cell_type, cell_count in initial_state.items():
+            for _ in range(cell_count):
+                reference_types.append(cell_type)
+                reference_times.append(0)
+        if r_max_cell > 0:
+            for cell in range(len(reference_types)):
+                queue.append((- math.log(random.random()) / r_max_cell, cell))
+            heapq.heapify(queue)
+
+        while queue and queue[0][0] <= duration:
+            current_time, cell = heapq.heappop(queue)
+            event_cell = float(self.flow(np.array([reference_types[cell]]), 
+                                         current_time - reference_times[cell], parameters)[0])
+            reference_types[cell] = event_cell
+            reference_times[cell] = current_time
+
+            event_rng = random.random() * r_max_cell
+            if event_rng <= r_max_b:
+                if event_rng <= self._r_b(event_cell, parameters):
+                    # BIRTH
+                    if free_slots:
+                        child = free_slots.pop()
+                        reference_types[child] = event_cell
+                        reference_times[child] = current_time
+                    else:
+                        child = len(reference_types)
+                        reference_types.append(event_cell)
+                        reference_times.append(current_time)
+                    heapq.heappush(queue, (current_time - math.log(random.random()) / r_max_cell, child))
+            elif event_rng - r_max_b <= self._r_d(event_cell, parameters):
+                # DEATH
+                free_slots.append(cell)
+                continue
+            heapq.heappush(queue, (current_time - math.log(random.random()) / r_max_cell, cell))
+
+        alive = np.array([cell for _, cell in queue] if r_max_cell > 0 else range(len(reference_types)), dtype=np.int64)
+        final_types = self.flow(np.array(reference_types, dtype=float)[alive],
+                                duration - np.array(reference_times, dtype=float)[alive], parameters)
+        final_state = {}
+        for cell_type in final_types.tolist():
+            final_state[cell_type] = final_state.get(cell_type, 0) + 1
+        return final_state
+
+    def _get_rate_maxima(self, parameters):
+        """Returns the maximal birth and death rates over [0, 1], cached per parameter set."""
+        key = tuple(sorted(parameters.items()))
+        if key not in self._rate_maxima:
+            r_max_b = self._r_b(minimize(lambda x: - self._r_b(x[0], parameters), np.array([1/2]), bounds = [(0, 1)]).x[0], parameters)
+            r_max_d = self._r_d(minimize(lambda x: - self._r_d(x[0], parameters), np.array([1/2]), bounds = [(0, 1)]).x[0], parameters)
+            self._rate_maxima[key] = (r_max_b, r_max_d)
+        return self._rate_maxima[key]
+
+    @staticmethod
+    def _drop_empty_types(cell_types, counts):
+        cell_counts = np.array(counts.to_list())
+        alive = cell_counts > 0
+        return cell_types[alive], _FenwickTree(cell_counts[alive])
+
+
+def _chebyshev_points(degree):
+    """Returns the degree + 1 Chebyshev points of [0, 1] in increasing order and their differentiation matrix."""
+    k = np.arange(degree + 1)
+    zs = np.cos(np.pi * k / degree)
+    weights = np.ones(degree + 1)
+    weights[0] = weights[-1] = 2
+    weights = weights * (-1) ** k
+    differences = zs[:, None] - zs[None, :] + np.eye(degree + 1)
+    differentiation = np.outer(weights, 1 / weights) / differences
+    differentiation -= np.diag(differentiation.sum(axis=1))
+    # x = (1 - z) / 2, so d/dx = -2 d/dz
+    return (1 - zs) / 2, -2 * differentiation
+
+
+class BranchingDiffusionDensity(Model):
+    """
+    Mean behavior of a BranchingDiffusion. The expected density n(x, t) of cells solves
+        dn/dt + d(f n)/dx = (b(x) - d(x)) n
+    which is solved by the method of characteristics: mass moves along the flow of the diffusion f
+    and is multiplied by exp of the integral of b - d along the way.
+
+    States are expected cell counts on bin_count equal bins of [0, 1] (a list), or 
+    a dictionary {type: count} of point masses. Runs return bin counts.
+    """
 
+    def __init__(self, branching_diffusion: BranchingDiffusion, bin_count: int, substep_count: int):
+        if bin_count < 2:
+            raise ValueError("Point masses are shared between two bins, so bin_count must be at least 2")
+        self.branching_diffusion = branching_diffusion
+        self.bin_count = bin_count
+        self.substep_count = substep_count
+        self.bin_edges = np.linspace(0, 1, bin_count + 1)
+        self.bin_centers = (self.bin_edges[1:] + self.bin_edges[:-1]) / 2
+        self.name = f"{getattr(branching_diffusion, 'name', 'Branching Diffusion')} (deterministic)"
+
+    def run(self, parameters, initial_state, duration):
+        if isinstance(initial_state, dict):
+            positions = np.array(list(initial_state.keys()), dtype=float)
+            masses = np.array(list(initial_state.values()), dtype=float)
+        else:
+            positions = self.bin_centers
+            masses = np.array(initial_state, dtype=float)
+
+        model = self.branching_diffusion
+        times = np.linspace(0, duration, self.substep_count + 1)
+        growth_rates = []
+        for time in times:
+            xs = model.flow(positions, time, parameters)
+            growth_rates.append([model._r_b(x, parameters) - model._r_d(x, parameters) for x in xs])
+        growth_rates = np.array(growth_rates)
+        log_growth = ((growth_rates[1:] + growth_rates[:-1]) / 2 * np.diff(times)[:, None]).sum(axis=0)
+        final_positions = model.flow(positions, duration, parameters)
+        return list(self._deposit(final_positions, masses * np.exp(log_growth)))
+
+    def to_density(self, state):
+        """Converts bin counts to a density over [0, 1] with total integral 1"""
+        state = np.array(state, dtype=float)
+        return state / state.sum() * self.bin_count
+
+    def _deposit(self, positions, masses):
+        """Shares each point mass between the two nearest bin centers."""
+        scaled = np.clip(positions * self.bin_count - 0.5, 0, self.bin_count - 1)
+        lower = np.minimum(np.floor(scaled).astype(np.int64), self.bin_count - 2)
+        upper_share = scaled - lower
+        counts = np.bincount(lower, weights=masses * (1 - upper_share), minlength=self.bin_count)
+        counts += np.bincount(lower + 1, weights=masses * upper_share, minlength=self.bin_count)
+        return counts
+
+
+class _FenwickTree:
+    """Counts supporting O(log n) updates and O(log n) lookup of the entry containing a cumulative position."""
+
+    def __init__(self, counts):
+        self._counts = [int(count) for count in counts]
+        self._size = len(self._counts)
+        self._tree = [0] + self._counts
+        for position in range(1, self._size + 1):
+            parent = position + (position & -position)
+            if parent <= self._size:
+                self._tree[parent] += self._tree[position]
+        self.total = sum(self._counts)
+        self.empty_count = self._counts.count(0)
+
+    def add(self, index, delta):
+        old_count = self._counts[index]
+        self._counts[index] = old_count + delta
+        self.empty_count += (old_count + delta == 0) - (old_count == 0)
+        self.total += delta
+        position = index + 1
+        while position <= self._size:
+            self._tree[position] += delta
+            position += position & -position
+
+    def find(self, value):
+        """Returns the index i with counts[:i].sum() <= value < counts[:i+1].sum()."""
+        position = 0
+        step = 1 << self._size.bit_length()
+        while step:
+            next_position = position + step
+            if next_position <= self._size and self._tree[next_position] <= value:
+                position = next_position
+                value -= self._tree[next_position]
+            step >>= 1
+        return min(position, self._size - 1)
+
+    def to_list(self):
+        return list(self._counts)
 
 
 class InfiniteSiteOneDimensional(BranchingDiffusion):
-    def __init__(self, r_b, r_d, r_um, r_mu):
+    def __init__(self, r_b, r_d, r_um, r_mu, constant_rates=False):
+        """If constant_rates, r_um and r_mu must not depend on x. 
+        The diffusion is then linear and cells flow by its exact exponential solution."""
         def diffusion(x, parameters):
             return r_um(x, parameters) * (1 - x) - r_mu(x, parameters) * x
         super().__init__(r_b, r_d, diffusion)
+        self._r_um = r_um
+        self._r_mu = r_mu
+        self.constant_rates = constant_rates
+
+    def flow(self, cell_types, duration, parameters):
+        if not self.constant_rates:
+            return super().flow(cell_types, duration, parameters)
+        # x' = r_um (1 - x) - r_mu x relaxes exponentially to r_um / (r_um + r_mu)
+        r_um = self._r_um(0, parameters)
+        r_mu = self._r_mu(0, parameters)
+        total_rate = r_um + r_mu
+        cell_types = np.asarray(cell_types, dtype=float)
+        if total_rate == 0:
+            return cell_types
+        stable_type = r_um / total_rate
+        return stable_type + (cell_types - stable_type) * np.exp(- total_rate * duration)
    
     
\ No newline at end of file
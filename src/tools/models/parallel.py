@@ -0,0 +1,94 @@
+"""
+This module runs independent PDMP samples in a pool of processes.
+
+Every task gets its own numpy generator from a child of one SeedSequence, so the streams of
+division times are independent and the whole run is reproducible from one seed.
+Workers reduce their samples to RunningMoments before returning them, so only the
+per-time sums cross between processes and the driver merges them exactly.
+"""
+
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.tools.models.pdmp import PDMP
+from src.tools.statistics import RunningMoments
+
+
+def estimate_wasserstein(parameters, times, relative_error=0.01, absolute_error=1e-3, confidence=0.95,
+                         min_sample_count=200, max_sample_count=100000, round_sample_count=1000, chunk_size=100,
+                         control_variate=True, worker_count=None, seed=None):
+    """
+    Same as PDMP.estimate_wasserstein, with the pairs shared between worker_count processes (by default one per core).
+    Each round every worker draws round_sample_count pairs, and rounds continue until the estimate is resolved
+    at every time or max_sample_count pairs are drawn. seed defaults to a draw from the random module.
+    Returns (moments, control_expectation) like PDMP.estimate_wasserstein.
+    """
+    times = np.asarray(times, dtype=float)
+    control_expectation = None
+    if control_variate:
+        control_expectation = PDMP.get_linear_coupled_distance(PDMP.convert_to_noncollaborative(parameters), times)
+    seeds = _get_seed_sequence(seed)
+    worker_count = worker_count or os.cpu_count()
+    moments = RunningMoments(len(times))
+    with ProcessPoolExecutor(worker_count) as executor:
+        while moments.count < max_sample_count:
+            counts = _divide(min(round_sample_count * worker_count, max_sample_count - moments.count), worker_count)
+            tasks = [(parameters, times, count, chunk_size, control_variate, child)
+                     for count, child in zip(counts, seeds.spawn(worker_count)) if count > 0]
+            for result in executor.map(_estimate_wasserstein_task, tasks):
+                moments.merge(result)
+            if moments.count < min_sample_count:
+                continue
+            estimate, _, high = moments.get_confidence_band(confidence, control_expectation)
+            if np.all(high - estimate <= np.maximum(relative_error * np.abs(estimate), absolute_error)):
+                break
+    return moments, control_expectation
+
+
+def sample_ensemble(parameters, initial_state, times, sample_count, chunk_size=100, worker_count=None, seed=None):
+    """
+    Returns the RunningMoments of sample_count independent trajectories from initial_state,
+    each with its own divisions, as vectors of length 3T ordered like the flattened (T, 3) states.
+    """
+    seeds = _get_seed_sequence(seed)
+    worker_count = worker_count or os.cpu_count()
+    counts = _divide(sample_count, worker_count)
+    tasks = [(parameters, initial_state, times, count, chunk_size, child)
+             for count, child in zip(counts, seeds.spawn(worker_count)) if count > 0]
+    moments = RunningMoments(3 * len(times))
+    with ProcessPoolExecutor(worker_count) as executor:
+        for result in executor.map(_sample_ensemble_task, tasks):
+            moments.merge(result)
+    return moments
+
+
+def _estimate_wasserstein_task(task):
+    parameters, times, sample_count, chunk_size, control_variate, seed = task
+    moments, _ = PDMP().estimate_wasserstein(parameters, times, relative_error=0, min_sample_count=sample_count,
+                                             max_sample_count=sample_count, chunk_size=chunk_size,
+                                             control_variate=control_variate, rng=np.random.default_rng(seed))
+    return moments
+
+
+def _sample_ensemble_task(task):
+    parameters, initial_state, times, sample_count, chunk_size, seed = task
+    rng = np.random.default_rng(seed)
+    model = PDMP()
+    moments = RunningMoments(3 * len(times))
+    for start in range(0, sample_count, chunk_size):
+        row_count = min(chunk_size, sample_count - start)
+        data = model.generate_batch_timepoint_data(parameters, [initial_state] * row_count, times, rng=rng)
+        moments.update(data.reshape(row_count, -1))
+    return moments
+
+
+def _get_seed_sequence(seed):
+    return np.random.SeedSequence(random.getrandbits(64) if seed is None else seed)
+
+
+def _divide(count, parts):
+    """Returns parts counts summing to count, as even as possible."""
+    return [count // parts + (i < count % parts) for i in range(parts)]
@@ -1,139 +1,457 @@
+import hashlib
+import warnings
 from copy import deepcopy
 from itertools import product
 from math import log
 from random import random
 
-from scipy.integrate import odeint, ode
+import numpy as np
+from scipy.integrate import odeint
+from scipy.linalg import expm
 
+from src.tools import io
+from src.tools.models.hitting_times import HittingTimeTable
+from src.tools.models.integrate import find_crossing_times, integrate_batch, propagate_batch
 from src.tools.models.population import PopulationModel
-from src.tools.models.rng import generate_poisson
+from src.tools.models.rng import generate_poisson, get_numpy_generator
+from src.tools.models.timepoints import ArraySink, iterate_merged_times
+from src.tools.models.transfer import TransferOperator
+from src.tools.statistics import RunningMoments
 
 
 class PDMP(PopulationModel):
     site_names = {0: "m", 1: "h", 2: "u"}
+    _rate_tensors = {}
+    _reduced_rate_tensors = {}
+    _linear_solutions = {}
+    _hitting_time_tables = {}
     def __init__(self): 
         super().__init__(3)
 
     def run(self, parameters, initial_state, duration):
-        state = deepcopy(initial_state)
+        if self.is_linear(parameters):
+            splitting_times = generate_poisson(parameters["b"], duration)
+            return self.generate_batch_timepoint_data(parameters, [initial_state], [duration], splitting_times)[0, -1]
+        state = np.array(initial_state[:2], dtype=float)
         last_diffusion = False
-        
-        """
-        def flow(x, t):
-            flow = [0, 0, 0]
-            for a, b, c in product(range(3), range(3), range(4)):
-                if c == 3: 
-                    noncollaborative_rate = self._get_parameter(parameters, a, b)
-                    flow[a] = flow[a] - x[a] * noncollaborative_rate
-                    flow[b] = flow[b] + x[a] * noncollaborative_rate
-                else:
-                    collaborative_rate = self._get_parameter(parameters, a, b, c)
-                    flow[a] = flow[a] - x[a] * x[c] * collaborative_rate
-                    flow[b] = flow[b] + x[a] * x[c] * collaborative_rate
-            return flow
-        """  
+        flow = self.reduced_flow(parameters)
+        jacobian = self.reduced_jacobian(parameters)
 
+        remaining = duration
         while True:            
             b = parameters["b"]
             waiting_time = - log(random()) / b
-            if waiting_time > duration:
-                waiting_time = duration
+            if waiting_time > remaining:
+                waiting_time = remaining
                 last_diffusion = True
-            flow = self.flow(parameters)
-            state = odeint(flow, state, [0, waiting_time], tfirst=True)[1]
+            remaining -= waiting_time
+            state = odeint(flow, state, [0, waiting_time], Dfun=jacobian, tfirst=True)[1]
             if last_diffusion:
-                return state
-            state = [0, state[0] + state[1] / 2, state[1] / 2 + state[2]]
+                return self.expand_states(state)
+            state = [0, state[0] + state[1] / 2]
 
-    def generate_timepoint_data(self, parameters, initial_state, times, splitting_times = None):
-        result = {0 : list(initial_state)}
-        time = 0
-        state = deepcopy(initial_state)
+    def generate_timepoint_data(self, parameters, initial_state, times, splitting_times = None, sink=None,
+                                chunk_size=10000):
+        """
+        Returns the TimepointData of one trajectory at 0, times and splitting_times (all sorted),
+        with the states just after the split at splitting times.
+        The trajectory is produced in chunks of chunk_size to 2 chunk_size times, merged as they are needed,
+        and written to sink (by default an ArraySink); the result is whatever sink.close() returns.
+        """
         if splitting_times is None:
             splitting_times = generate_poisson(parameters["b"], times[-1])
-        flow = self._make_flow_func(parameters)
-        
-        all_times = times + splitting_times
-        all_times.sort()
-
-        chunk = []
-        for time in all_times:
-            chunk.append(time)
-            if time in splitting_times:
-                data = odeint(flow, state, chunk)
-                for t, d in zip(chunk, data):
-                    result[t] = list(d)
-                presplit = result[time]
-                postsplit = [0, presplit[0] + presplit[1] / 2, presplit[1] / 2 + presplit[2]]
-                result[time] = list(postsplit)
-                state = postsplit
-                chunk = [time]
-        data = odeint(flow, state, chunk)
-        for t, d in zip(chunk, data):
-            result[t] = list(d)
-        return result
+        if sink is None:
+            sink = ArraySink()
+        state = np.array(initial_state, dtype=float)
+        previous_time = None
+        for all_times, is_split in iterate_merged_times(times, splitting_times, chunk_size):
+            if previous_time is None:
+                if is_split[0]:
+                    # a division at time 0 applies to the initial state
+                    state = self._split(state[None, :])[0]
+                states = self._generate_segments(parameters, state, all_times, is_split)
+            else:
+                # every later chunk starts from the last state of the previous one, after its split
+                states = self._generate_segments(parameters, state, np.append(previous_time, all_times),
+                                                 np.append(False, is_split))[1:]
+            state = states[-1]
+            previous_time = all_times[-1]
+            sink.write(all_times, states, is_split)
+        return sink.close()
+
+    def _generate_segments(self, parameters, initial_state, times, is_split):
+        """
+        Returns the (T, 3) array of states at times, starting from initial_state at times[0]
+        and splitting at the other times marked in is_split.
+        """
+        states = np.empty((len(times), 3))
+        if self.is_linear(parameters):
+            states[:] = self.generate_batch_timepoint_data(parameters, [initial_state], times - times[0],
+                                                           times[1:][is_split[1:]] - times[0])[0]
+            states[0] = initial_state
+            return states
+        flow = self.reduced_flow(parameters)
+        jacobian = self.reduced_jacobian(parameters)
+        states[0] = initial_state
+        reduced = states[:, :2]
+        ends = np.flatnonzero(is_split[1:]) + 1
+        if len(ends) == 0 or ends[-1] != len(times) - 1:
+            ends = np.append(ends, len(times) - 1)
+        start = 0
+        for end in ends:
+            if end > start:
+                reduced[start:end + 1] = odeint(flow, reduced[start], times[start:end + 1],
+                                                Dfun=jacobian, tfirst=True)
+                if is_split[end]:
+                    reduced[end:end + 1] = self._split_reduced(reduced[end:end + 1])
+            start = end
+        states[1:, 2] = 1 - reduced[1:].sum(axis=1)
+        return states
+
+    def generate_batch_timepoint_data(self, parameters, initial_states, times, splitting_times=None, rng=None,
+                                      reduced=False):
+        """
+        Returns an (N, T, 3) array with the state of each of the N rows of initial_states at each of the T times,
+        integrating all rows together, or if reduced is set the (N, T, 2) array of the reduced states (m, h).
+        parameters is either one parameter set or a list with one parameter set per row.
+        splitting_times is either None (each row divides at the times of its own Poisson process),
+        a list of division times shared by all rows, or a list with one list of division times per row.
+        """
+        states = np.array(initial_states, dtype=float).reshape(-1, 3)
+        row_count = len(states)
+        parameter_sets = [parameters] * row_count if isinstance(parameters, dict) else list(parameters)
+        if len(parameter_sets) != row_count:
+            raise ValueError("Expected one parameter set per initial state")
+        if splitting_times is None:
+            if rng is None:
+                rng = get_numpy_generator()
+            splitting_times = generate_poisson([p["b"] for p in parameter_sets], times[-1], size=row_count, rng=rng)
+        elif len(splitting_times) == 0 or np.ndim(splitting_times[0]) == 0:
+            splitting_times = [splitting_times] * row_count
+        if all(self.is_linear(p) for p in parameter_sets):
+            # without collaborative rates every segment between divisions is solved exactly
+            result = propagate_batch(self._batch_linear_propagator(parameter_sets), states, times,
+                                     jump_times=splitting_times, jump=lambda x, rows: self._split(x))
+            return result[:, :, :2] if reduced else result
+        # the states stay on the simplex, so only (m, h) is integrated
+        flow, jacobian = self._batch_flow(parameter_sets)
+        result = integrate_batch(flow, jacobian, states[:, :2], times, jump_times=splitting_times,
+                                 jump=lambda y, rows: self._split_reduced(y))
+        return result if reduced else self.expand_states(result)
 
     def sample_simulataneously(self, parameters, initial_states, times):
+        """Runs every initial state with the same division times.
+        Returns one dictionary {time: state} per initial state."""
         splitting_times = generate_poisson(parameters["b"], times[-1])
-        data = []
-        for initial_state in initial_states:
-            data.append(self.generate_timepoint_data(parameters, initial_state, times, splitting_times=splitting_times))
-        return data
+        data = self.generate_batch_timepoint_data(parameters, initial_states, times, splitting_times=splitting_times)
+        return [{time: state.tolist() for time, state in zip(times, row)} for row in data]
+
+    def sample_wasserstein(self, parameters, times, sample_count, chunk_size=100):
+        """Returns {time: mean coupled distance} from the fully methylated and unmethylated starts, over sample_count pairs."""
+        moments, _ = self.estimate_wasserstein(parameters, times, relative_error=0, min_sample_count=sample_count,
+                                               max_sample_count=sample_count, chunk_size=chunk_size,
+                                               control_variate=False)
+        return {time: float(mean) for time, mean in zip(times, moments.mean)}
 
-    def sample_wasserstein(self, parameters, times, sample_count):
+    def estimate_wasserstein(self, parameters, times, relative_error=0.01, absolute_error=1e-3, confidence=0.95,
+                             min_sample_count=200, max_sample_count=100000, chunk_size=100, control_variate=True,
+                             rng=None):
+        """
+        Returns (moments, control_expectation): the RunningMoments of the distance between coupled pairs started
+        fully methylated and unmethylated, sharing division times, at each of times, and the expectation to pass
+        to moments.get_confidence_band (None without control_variate).
+        Pairs are drawn chunk_size at a time until the half width of the confidence band is below relative_error
+        times the estimate, or below absolute_error where the distance has decayed toward 0, at every time
+        (or max_sample_count pairs). With control_variate the same divisions are applied to the noncollaborative
+        parameters, whose expected distance is known exactly (get_linear_coupled_distance).
+        """
         if not self.verify_wasserstein_lemma(parameters):
-            res = input("Warning: coupling may not be optimal. Continue? y/n: ")
-            if res == "n":
-                return
-        
-        first_initial = [1, 0, 0]
-        second_initial = [0, 0, 1]
-        initial_states = [first_initial, second_initial]
-        total_distances = {time: 0 for time in times}
-        for _ in range(sample_count):
-            print(_)
-            result = self.sample_simulataneously(parameters, initial_states, times)
-            first_result = result[0]
-            second_result = result[1]
-            for time in times:
-                first_data = first_result[time]
-                second_data = second_result[time]
-                distance = first_data[0] - second_data[0] + second_data[2] - first_data[2]
-                total_distances[time] = total_distances[time] + distance
-        average_distances = {}
-        for time in times:
-            average_distances[time] = total_distances[time] / sample_count
-        return average_distances
-        
-    def get_hitting_time(self, parameters, start, end, stepsize = 0.01):
+            warnings.warn("The coupling may not be optimal for these parameters, so distances are upper bounds")
+        if rng is None:
+            rng = get_numpy_generator()
+        times = np.asarray(times, dtype=float)
+        control_parameters = self.convert_to_noncollaborative(parameters)
+        control_expectation = self.get_linear_coupled_distance(control_parameters, times) if control_variate else None
+        moments = RunningMoments(len(times))
+        while moments.count < max_sample_count:
+            pair_count = min(chunk_size, max_sample_count - moments.count)
+            # rows 2i and 2i + 1 share division times
+            splitting_times = [pair_times for pair_times in generate_poisson(parameters["b"], times[-1],
+                                                                            size=pair_count, rng=rng)
+                               for _ in range(2)]
+            initial_states = [[1, 0, 0], [0, 0, 1]] * pair_count
+            distances = self._get_coupled_distances(parameters, initial_states, times, splitting_times)
+            controls = None
+            if control_variate:
+                controls = self._get_coupled_distances(control_parameters, initial_states, times, splitting_times)
+            moments.update(distances, controls)
+            if moments.count < min_sample_count:
+                continue
+            estimate, low, high = moments.get_confidence_band(confidence, control_expectation)
+            if np.all(high - estimate <= np.maximum(relative_error * np.abs(estimate), absolute_error)):
+                break
+        return moments, control_expectation
+
+    def _get_coupled_distances(self, parameters, initial_states, times, splitting_times):
+        """Returns the (pairs, T) array of distances m - u between rows 2i and 2i + 1 of the batch."""
+        data = self.generate_batch_timepoint_data(parameters, initial_states, times, splitting_times=splitting_times)
+        difference = data[0::2] - data[1::2]
+        return difference[:, :, 0] - difference[:, :, 2]
+
+    @classmethod
+    def get_linear_coupled_distance(cls, parameters, times):
+        """
+        Returns the expected coupled distance between the fully methylated and unmethylated starts for linear parameters.
+        Divisions are linear too, so the mean state follows x0 @ expm(t (linear + b (split - I))).
+        """
+        split = np.array([[0, 1, 0], [0, 0.5, 0.5], [0, 0, 1]])
+        generator = cls.get_rate_tensors(parameters)[0] + parameters["b"] * (split - np.eye(3))
+        difference = np.array([1., 0, -1])
+        return np.array([difference @ expm(generator * time) @ difference for time in times])
+
+    def get_hitting_time(self, parameters, start, end, max_time=1e4):
+        """Returns the time for the flow from [0, start, 1 - start] to reach 2m + h = end."""
+        return float(self.get_hitting_times(parameters, [start], [end], max_time)[0])
+
+    def get_hitting_times(self, parameters, starts, ends, max_time=1e4):
+        """
+        Returns the array of times for the flow from each [0, start, 1 - start] to first reach 2m + h = end,
+        solving all (start, end) pairs (broadcast against each other) in one batch.
+        Times are infinite when the level is not reached by max_time.
+        """
         if not self.verify_wasserstein_lemma(parameters):
             raise NotImplementedError
-        initial_condition = [0, start, 1 - start]
-        r = ode(self.flow(parameters))
-        r.set_initial_value(initial_condition)
-        while r.successful() and r.y[0] * 2 + r.y[1] < end:
-            r.integrate(r.t + stepsize)
-        return r.t
-
+        starts, ends = np.broadcast_arrays(np.asarray(starts, dtype=float), np.asarray(ends, dtype=float))
+        initial_states = np.stack([np.zeros(starts.size), starts.ravel()], axis=1)
+        flow, jacobian = self._batch_flow([parameters])
+        methylation = lambda y: 2 * y[:, 0] + y[:, 1]
+        times = find_crossing_times(flow, jacobian, initial_states, methylation, ends.ravel(), max_time)
+        return times.reshape(starts.shape)
 
+    def get_hitting_time_table(self, parameters, start_count=201, level_count=401, max_time=1e3,
+                               time_count=4001, persist=True):
+        """
+        Returns a HittingTimeTable of the times for the flow from [0, start, 1 - start] to reach 2m + h = level,
+        with one integration per start on an even grid of start_count starts in [0, 1].
+        Each trajectory is sampled on time_count times spaced geometrically up to max_time.
+        Tables are cached per parameter set and grid, and if persist is set also saved in output/tables.
+        Like get_hitting_times, raises NotImplementedError if the parameters fail verify_wasserstein_lemma.
+        """
+        if not self.verify_wasserstein_lemma(parameters):
+            raise NotImplementedError
+        settings = (tuple(sorted(parameters.items())), start_count, level_count, max_time, time_count)
+        if settings in self._hitting_time_tables:
+            return self._hitting_time_tables[settings]
+        filename = "hitting_times_" + hashlib.sha1(repr(settings).encode()).hexdigest()[:16]
+        if persist and io.has_table(filename):
+            table = HittingTimeTable.from_arrays(io.read_table(filename))
+        else:
+            starts = np.linspace(0, 1, start_count)
+            times = np.concatenate([[0], np.geomspace(1e-4, max_time, time_count - 1)])
+            initial_states = np.stack([np.zeros(start_count), starts, 1 - starts], axis=1)
+            data = self.generate_batch_timepoint_data(parameters, initial_states, times, splitting_times=[],
+                                                      reduced=True)
+            values = 2 * data[:, :, 0] + data[:, :, 1]
+            table = HittingTimeTable.from_trajectories(starts, np.linspace(0, 2, level_count), times, values)
+            if persist:
+                io.write_table(table.to_arrays(), filename)
+        self._hitting_time_tables[settings] = table
+        return table
 
+    def get_transfer_operator(self, parameters, cell_count=400, time_count=2001, bin_count=100, max_divisions=40):
+        """
+        Returns the TransferOperator of the states just after divisions, on cell_count cells of h.
+        The flow from each cell center is integrated once, in one batch, on time_count times spaced
+        geometrically up to max_divisions mean division times.
+        """
+        birth_rate = parameters["b"]
+        starts = (np.arange(cell_count) + 0.5) / cell_count
+        times = np.concatenate([[0], np.geomspace(1e-3 / birth_rate, max_divisions / birth_rate, time_count - 1)])
+        initial_states = np.stack([np.zeros(cell_count), starts, 1 - starts], axis=1)
+        trajectories = self.generate_batch_timepoint_data(parameters, initial_states, times, splitting_times=[],
+                                                          reduced=True)
+        return TransferOperator.from_trajectories(starts, times, trajectories, birth_rate, bin_count)
 
     @classmethod
-    def flow(cls, parameters) -> list[float]:
+    def flow(cls, parameters):
+        """
+        Returns the right-hand side (t, x) -> dx/dt of the methylation ODE.
+        x may be a single state (m, h, u) or an (N, 3) array of states.
+        """
+        linear, quadratic = cls.get_rate_tensors(parameters)
+        # contracting the outer product x x^T with a (9, 3) matrix is much faster than a three operand einsum
+        quadratic = quadratic.reshape(9, 3)
         def flow_func(t, x):
-            flow_at_point = [0, 0, 0]
+            x = np.asarray(x)
+            outer = (x[..., :, None] * x[..., None, :]).reshape(x.shape[:-1] + (9,))
+            return x @ linear + outer @ quadratic
+        return flow_func
+
+    @classmethod
+    def jacobian(cls, parameters):
+        """
+        Returns the exact Jacobian (t, x) -> d(dx/dt)/dx of the flow, with entry [b, j] = d(dx_b/dt)/dx_j.
+        x may be a single state or an (N, 3) array of states (giving an (N, 3, 3) array).
+        """
+        linear, quadratic = cls.get_rate_tensors(parameters)
+        # d(dx_b/dt)/dx_j = linear[j, b] + sum_a x_a (quadratic[j, a, b] + quadratic[a, j, b])
+        combined = cls._get_jacobian_tensor(quadratic)
+        def jacobian_func(t, x):
+            x = np.asarray(x)
+            return np.swapaxes(linear + (x @ combined).reshape(x.shape[:-1] + (3, 3)), -1, -2)
+        return jacobian_func
+
+    @classmethod
+    def reduced_flow(cls, parameters):
+        """
+        Returns the right-hand side (t, y) -> dy/dt of the methylation ODE in the reduced coordinates y = (m, h),
+        with u = 1 - m - h. y may be a single reduced state or an (N, 2) array of them.
+        """
+        constant, linear, quadratic = cls.get_reduced_rate_tensors(parameters)
+        quadratic = quadratic.reshape(4, 2)
+        def flow_func(t, y):
+            y = np.asarray(y)
+            outer = (y[..., :, None] * y[..., None, :]).reshape(y.shape[:-1] + (4,))
+            return constant + y @ linear + outer @ quadratic
+        return flow_func
+
+    @classmethod
+    def reduced_jacobian(cls, parameters):
+        """Returns the exact Jacobian (t, y) -> d(dy/dt)/dy of reduced_flow, with entry [b, j] = d(dy_b/dt)/dy_j."""
+        _, linear, quadratic = cls.get_reduced_rate_tensors(parameters)
+        combined = cls._get_jacobian_tensor(quadratic)
+        def jacobian_func(t, y):
+            y = np.asarray(y)
+            return np.swapaxes(linear + (y @ combined).reshape(y.shape[:-1] + (2, 2)), -1, -2)
+        return jacobian_func
+
+    @classmethod
+    def get_reduced_rate_tensors(cls, parameters):
+        """
+        Returns (constant, linear, quadratic), cached per parameter set, such that with y = (m, h)
+            dy_b/dt = constant[b] + sum_a y_a linear[a, b] + sum_{a, c} y_a y_c quadratic[a, c, b],
+        obtained by substituting x = (0, 0, 1) + y @ [[1, 0, -1], [0, 1, -1]] into get_rate_tensors.
+        """
+        key = tuple(sorted(parameters.items()))
+        if key not in cls._reduced_rate_tensors:
+            linear, quadratic = cls.get_rate_tensors(parameters)
+            embedding = np.array([[1., 0, -1], [0, 1, -1]])
+            constant = linear[2, :2] + quadratic[2, 2, :2]
+            reduced_linear = embedding @ (linear + quadratic[:, 2, :] + quadratic[2, :, :])
+            reduced_quadratic = np.einsum("ia,jc,acb->ijb", embedding, embedding, quadratic)
+            cls._reduced_rate_tensors[key] = (constant, reduced_linear[:, :2], reduced_quadratic[:, :, :2])
+        return cls._reduced_rate_tensors[key]
+
+    @classmethod
+    def get_rate_tensors(cls, parameters):
+        """
+        Returns (linear, quadratic), cached per parameter set, such that 
+            dx_b/dt = sum_a x_a linear[a, b] + sum_{a, c} x_a x_c quadratic[a, c, b].
+        Each rate r_ab (and r_ab_c) moves mass from a to b in proportion to x_a (and x_a x_c).
+        """
+        key = tuple(sorted(parameters.items()))
+        if key not in cls._rate_tensors:
+            linear = np.zeros((3, 3))
+            quadratic = np.zeros((3, 3, 3))
             for a, b, c in product(range(3), range(3), range(4)):
-                if c == 3: 
-                    noncollaborative_rate = cls._get_parameter(parameters, a, b)
-                    flow_at_point[a] = flow_at_point[a] - x[a] * noncollaborative_rate
-                    flow_at_point[b] = flow_at_point[b] + x[a] * noncollaborative_rate
+                if c == 3:
+                    rate = cls._get_parameter(parameters, a, b)
+                    linear[a, a] -= rate
+                    linear[a, b] += rate
                 else:
-                    collaborative_rate = cls._get_parameter(parameters, a, b, c)
-                    flow_at_point[a] = flow_at_point[a] - x[a] * x[c] * collaborative_rate
-                    flow_at_point[b] = flow_at_point[b] + x[a] * x[c] * collaborative_rate
-            return flow_at_point
-        return flow_func
+                    rate = cls._get_parameter(parameters, a, b, c)
+                    quadratic[a, c, a] -= rate
+                    quadratic[a, c, b] += rate
+            cls._rate_tensors[key] = (linear, quadratic)
+        return cls._rate_tensors[key]
     
+    @classmethod
+    def _batch_flow(cls, parameter_sets):
+        """Returns the reduced flow and Jacobian (states, rows) -> ... of integrate_batch on (N, 2) arrays of (m, h),
+        where row i follows parameter_sets[i]."""
+        keys = [tuple(sorted(parameters.items())) for parameters in parameter_sets]
+        if len(set(keys)) == 1:
+            flow = cls.reduced_flow(parameter_sets[0])
+            jacobian = cls.reduced_jacobian(parameter_sets[0])
+            return (lambda y, rows: flow(0, y)), (lambda y, rows: jacobian(0, y))
+        tensors = [cls.get_reduced_rate_tensors(parameters) for parameters in parameter_sets]
+        constant = np.stack([triple[0] for triple in tensors])
+        linear = np.stack([triple[1] for triple in tensors])
+        flat_quadratic = np.stack([triple[2].reshape(4, 2) for triple in tensors])
+        combined = np.stack([cls._get_jacobian_tensor(triple[2]) for triple in tensors])
+        def flow_func(y, rows):
+            outer = (y[:, :, None] * y[:, None, :]).reshape(-1, 1, 4)
+            return constant[rows] + (y[:, None, :] @ linear[rows] + outer @ flat_quadratic[rows])[:, 0]
+        def jacobian_func(y, rows):
+            return np.swapaxes(linear[rows] + (y[:, None, :] @ combined[rows]).reshape(-1, 2, 2), 1, 2)
+        return flow_func, jacobian_func
+
+    @classmethod
+    def is_linear(cls, parameters):
+        """Whether every collaborative rate is zero, so that the flow is dx/dt = x @ linear."""
+        return not cls.get_rate_tensors(parameters)[1].any()
+
+    @classmethod
+    def get_linear_solution(cls, parameters):
+        """
+        Returns (eigenvectors, eigenvalues, inverse), cached per parameter set, with
+            x0 @ expm(linear t) = ((x0 @ eigenvectors) * exp(eigenvalues t)) @ inverse.
+        Returns None when the linear part is not safely diagonalizable over the reals,
+        in which case propagation falls back to expm.
+        """
+        key = tuple(sorted(parameters.items()))
+        if key not in cls._linear_solutions:
+            linear = cls.get_rate_tensors(parameters)[0]
+            eigenvalues, eigenvectors = np.linalg.eig(linear)
+            solution = None
+            if np.all(np.isreal(eigenvalues)) and np.linalg.cond(eigenvectors) < 1e8:
+                eigenvectors = np.real(eigenvectors)
+                solution = (eigenvectors, np.real(eigenvalues), np.linalg.inv(eigenvectors))
+            cls._linear_solutions[key] = solution
+        return cls._linear_solutions[key]
+
+    @classmethod
+    def _batch_linear_propagator(cls, parameter_sets):
+        """Returns the exact solution (states, durations, rows) -> states of propagate_batch
+        for linear parameter sets, where row i follows parameter_sets[i]."""
+        linear = np.stack([cls.get_rate_tensors(parameters)[0] for parameters in parameter_sets])
+        solutions = [cls.get_linear_solution(parameters) for parameters in parameter_sets]
+        if any(solution is None for solution in solutions):
+            def propagate(x, durations, rows):
+                return (x[:, None, :] @ expm(linear[rows] * durations[:, None, None]))[:, 0]
+            return propagate
+        eigenvectors = np.stack([solution[0] for solution in solutions])
+        eigenvalues = np.stack([solution[1] for solution in solutions])
+        inverses = np.stack([solution[2] for solution in solutions])
+        def propagate(x, durations, rows):
+            # x0 @ V maps onto the eigenbasis, where the flow only rescales each coordinate
+            coefficients = (x[:, None, :] @ eigenvectors[rows])[:, 0] * np.exp(eigenvalues[rows] * durations[:, None])
+            return (coefficients[:, None, :] @ inverses[rows])[:, 0]
+        return propagate
+
+    @staticmethod
+    def _get_jacobian_tensor(quadratic):
+        """Returns the (n, n * n) matrix taking x to the flattened quadratic part of the Jacobian,
+        indexed [j, b] as d(dx_b/dt)/dx_j."""
+        dimension = len(quadratic)
+        return (quadratic.transpose(1, 0, 2) + quadratic).reshape(dimension, dimension ** 2)
+
+    @staticmethod
+    def _split(states):
+        """Applies the division map (m, h, u) -> (0, m + h / 2, h / 2 + u) to an (N, 3) array of states."""
+        m, h, u = states.T
+        return np.stack([np.zeros_like(m), m + h / 2, h / 2 + u], axis=1)
+
+    @staticmethod
+    def _split_reduced(states):
+        """Applies the division map (m, h) -> (0, m + h / 2) to an (N, 2) array of reduced states."""
+        return np.stack([np.zeros(len(states)), states[:, 0] + states[:, 1] / 2], axis=1)
+
+    @staticmethod
+    def expand_states(states):
+        """Returns the (..., 3) array of states (m, h, 1 - m - h) of an (..., 2) array of reduced states."""
+        return np.concatenate([states, 1 - states.sum(axis=-1, keepdims=True)], axis=-1)
+
     @staticmethod
     def verify_wasserstein_lemma(parameters):
         if parameters["r_hu_u"] < parameters["r_uh_h"]:
@@ -177,21 +495,6 @@ class PDMP(PopulationModel):
         return p2
 
 
-    def _make_flow_func(self, parameters): 
-        def flow(x, t):
-            flow = [0, 0, 0]
-            for a, b, c in product(range(3), range(3), range(4)):
-                if c == 3: 
-                    noncollaborative_rate = self._get_parameter(parameters, a, b)
-                    flow[a] = flow[a] - x[a] * noncollaborative_rate
-                    flow[b] = flow[b] + x[a] * noncollaborative_rate
-                else:
-                    collaborative_rate = self._get_parameter(parameters, a, b, c)
-                    flow[a] = flow[a] - x[a] * x[c] * collaborative_rate
-                    flow[b] = flow[b] + x[a] * x[c] * collaborative_rate
-            return flow
-        return flow
-    
     @classmethod
     def _get_parameter(cls, parameters, a, b, c = None):
             """gets the parameter r_ab_c for a -> b mediated by c"""
@@ -1,4 +1,5 @@
 from scipy.linalg import expm, eig
+from scipy.sparse.linalg import expm_multiply, eigs
 
 from src.tools.models.model import Model
 import matplotlib.pyplot as plt
@@ -110,3 +111,22 @@ class ExponentialPopulationModel(PopulationModel):
 
     def _get_instantaneous_transition_matrix(self, parameters):
         return self.get_generator_from_parameters(parameters)
+
+
+class SparseExponentialPopulationModel(ExponentialPopulationModel):
+    """
+    An ExponentialPopulationModel whose generator is a scipy sparse matrix.
+    Runs via expm_multiply so the dense exponential is never formed, 
+    which keeps large type spaces tractable.
+    """
+
+    def run(self, parameters, initial_state, duration):
+        transition_matrix = self._get_instantaneous_transition_matrix(parameters)
+        return list(expm_multiply(duration * transition_matrix.T, np.array(initial_state, dtype=float)))
+
+    def get_long_term_behavior(self, parameters):
+        """Returns a double (growth rate: float, stable population fractions: list)"""
+        transition_matrix = self._get_instantaneous_transition_matrix(parameters)
+        vals, vecs = eigs(transition_matrix.T.tocsc(), k=1, which="LR")
+        vec = np.real(vecs[:, 0])
+        return np.real(vals[0]), list(vec / sum(vec))
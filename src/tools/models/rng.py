@@ -1,28 +1,77 @@
 import random
 from math import log
-from scipy.optimize import minimize_scalar
+
+import numpy as np
+
+
+def get_numpy_generator():
+    # seeded from the random module so that random.seed also fixes numpy draws
+    return np.random.default_rng(random.getrandbits(64))
 
 
 def generate_exponential_waiting_time(rate):
     return -log(random.random()) / rate
 
-def generate_poisson(rate, duration):
-    t = 0
-    times = []
-    while True:
-        t += generate_exponential_waiting_time(rate)
-        if t > duration:
-            return times
-        times.append(t)
-
-def generate_poisson_nonhom(rate_func, duration, max_rate = None):
-    times = []
+def generate_poisson(rate, duration, size=None, rng=None):
+    """
+    Returns the sorted event times of a Poisson process with the given rate on [0, duration].
+    The number of events is drawn first and the events are then sorted uniforms.
+    With size, returns a list of size arrays of independent processes, drawn together,
+    and rate may be an array of size rates. Without size, returns one list.
+    """
+    if rng is None:
+        rng = get_numpy_generator()
+    if size is None:
+        return np.sort(rng.uniform(0, duration, rng.poisson(rate * duration))).tolist()
+    counts = rng.poisson(np.broadcast_to(rate, size) * duration)
+    return _sort_by_process(rng.uniform(0, duration, counts.sum()), np.repeat(np.arange(size), counts), duration, size)
+
+def generate_poisson_nonhom(rate_func, duration, max_rate=None, size=None, rng=None, grid_count=100):
+    """
+    Returns the sorted event times of a Poisson process with rate rate_func(t) on [0, duration], by thinning.
+    Candidates come from a majorant that is constant on each of grid_count cells (or max_rate everywhere if given),
+    and are accepted with probability rate / majorant. On each cell the majorant is the largest rate seen at the
+    ends and middle of the cell, raised by the largest change between those samples to cover a peak between them.
+    Raises ValueError if a candidate still exceeds the majorant, since the process would be biased;
+    pass max_rate or a larger grid_count then. rate_func may take an array of times or a single time.
+    size works as in generate_poisson.
+    """
+    if rng is None:
+        rng = get_numpy_generator()
+    process_count = 1 if size is None else size
     if max_rate is None:
-        min_result = minimize_scalar(lambda x : - rate_func(x), duration / 2, bounds = (0, duration))
-        max_rate = rate_func(min_result.x)
-    potential_times = generate_poisson(max_rate, duration)
-    for time in potential_times:
-        true_rate = rate_func(time)
-        if random.random() < true_rate / max_rate:
-            times.append(time)
-    return times
+        edges = np.linspace(0, duration, grid_count + 1)
+        samples = _evaluate_rate(rate_func, np.linspace(0, duration, 2 * grid_count + 1))
+        left, middle, right = samples[:-1:2], samples[1::2], samples[2::2]
+        majorant = (np.maximum(np.maximum(left, middle), right)
+                    + np.maximum(np.abs(middle - left), np.abs(right - middle)))
+    else:
+        edges = np.array([0, duration])
+        majorant = np.array([max_rate])
+    lengths = np.diff(edges)
+    counts = rng.poisson(np.broadcast_to(majorant * lengths, (process_count, len(majorant))))
+    cells = np.tile(np.arange(len(majorant)), process_count).repeat(counts.ravel())
+    processes = np.arange(process_count).repeat(counts.sum(axis=1))
+    candidates = edges[cells] + lengths[cells] * rng.random(len(cells))
+    ratios = _evaluate_rate(rate_func, candidates) / majorant[cells]
+    if np.any(ratios > 1):
+        raise ValueError("The rate exceeds its majorant, pass max_rate or use a finer grid")
+    accepted = rng.random(len(candidates)) < ratios
+    result = _sort_by_process(candidates[accepted], processes[accepted], duration, process_count)
+    return result[0].tolist() if size is None else result
+
+def _evaluate_rate(rate_func, times):
+    """Evaluates rate_func on an array of times at once, or time by time if it only takes single times."""
+    try:
+        rates = np.asarray(rate_func(times), dtype=float)
+    except (TypeError, ValueError):
+        rates = None
+    if rates is None or rates.shape != times.shape:
+        rates = np.array([rate_func(time) for time in times], dtype=float)
+    return rates
+
+def _sort_by_process(times, processes, duration, process_count):
+    """Returns the sorted times of each process, with one sort of the times offset by their process."""
+    order = np.argsort(times + processes * (2 * duration + 1), kind="stable")
+    boundaries = np.cumsum(np.bincount(processes, minlength=process_count))[:-1]
+    return np.split(times[order], boundaries)
@@ -0,0 +1,188 @@
+"""
+This module contains the array backed output of single PDMP trajectories.
+
+A trajectory is sampled at the union of the requested times and the splitting times.
+Both are sorted already, so they are merged in one pass, and the states are written
+into one preallocated (T, 3) array instead of a dictionary of lists.
+
+Very long trajectories are produced in chunks and handed to a sink, which either collects them
+(ArraySink), streams them to disk (FileSink) or thins them to a few points per bucket of time
+before passing them on (DecimatingSink). The union of the times is itself merged one chunk at a time
+(iterate_merged_times), so with a streaming sink the memory used beyond the requested and splitting
+times is that of one chunk.
+"""
+
+from collections.abc import Mapping
+
+import numpy as np
+
+from src.tools import io
+
+COLUMN_COUNT = 5  # time, m, h, u, is_split
+
+
+def merge_times(times, splitting_times):
+    """
+    Returns the sorted union of 0, times and splitting_times (both sorted),
+    with a mask of the entries that are splitting times.
+    """
+    times = np.asarray(times, dtype=float)
+    if len(times) == 0 or times[0] != 0:
+        times = np.concatenate([[0.], times])
+    return _merge_sorted(times, np.asarray(splitting_times, dtype=float))
+
+
+def iterate_merged_times(times, splitting_times, chunk_size):
+    """
+    Yields the entries of merge_times(times, splitting_times) as consecutive chunks (all_times, is_split)
+    of chunk_size to 2 chunk_size entries, merging only the next chunk_size times and splitting times each step.
+    """
+    times = np.asarray(times, dtype=float)
+    splitting_times = np.asarray(splitting_times, dtype=float)
+    time_index = split_index = 0
+    is_first = True
+    while is_first or time_index < len(times) or split_index < len(splitting_times):
+        time_window = times[time_index:time_index + chunk_size]
+        split_window = splitting_times[split_index:split_index + chunk_size]
+        # every entry up to the end of a full window is in both windows
+        cutoff = np.inf
+        if time_index + chunk_size < len(times):
+            cutoff = time_window[-1]
+        if split_index + chunk_size < len(splitting_times):
+            cutoff = min(cutoff, split_window[-1])
+        time_count = np.searchsorted(time_window, cutoff, side="right")
+        split_count = np.searchsorted(split_window, cutoff, side="right")
+        all_times, is_split = _merge_sorted(time_window[:time_count], split_window[:split_count])
+        time_index += time_count
+        split_index += split_count
+        if is_first and (len(all_times) == 0 or all_times[0] != 0):
+            all_times = np.concatenate([[0.], all_times])
+            is_split = np.concatenate([[False], is_split])
+        is_first = False
+        yield all_times, is_split
+
+
+def _merge_sorted(times, splitting_times):
+    if len(times) == 0:
+        return splitting_times.copy(), np.ones(len(splitting_times), dtype=bool)
+    positions = np.searchsorted(times, splitting_times)
+    existing = times[np.minimum(positions, len(times) - 1)] == splitting_times
+    inserted = ~existing
+    all_times = np.insert(times, positions[inserted], splitting_times[inserted])
+    is_split = np.zeros(len(all_times), dtype=bool)
+    # every inserted splitting time shifts the later entries by one
+    is_split[positions + np.cumsum(inserted) - inserted] = True
+    return all_times, is_split
+
+
+class TimepointData(Mapping):
+    """
+    States of one trajectory at sorted times, read like the dictionary {time: state}.
+        - times is the (T,) array of times and states the (T, 3) array of states.
+        - is_split marks the splitting times, whose states are the ones just after the split.
+    """
+
+    def __init__(self, times, states, is_split=None):
+        self.times = times
+        self.states = states
+        self.is_split = np.zeros(len(times), dtype=bool) if is_split is None else is_split
+
+    def __getitem__(self, time):
+        index = np.searchsorted(self.times, time)
+        if index == len(self.times) or self.times[index] != time:
+            raise KeyError(time)
+        return self.states[index]
+
+    def __iter__(self):
+        return iter(self.times.tolist())
+
+    def __len__(self):
+        return len(self.times)
+
+    def to_dict(self):
+        """Returns the dictionary {time: state} with states as lists."""
+        return dict(zip(self.times.tolist(), self.states.tolist()))
+
+
+class ArraySink:
+    """Collects the chunks of a trajectory in memory; close returns their TimepointData."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, times, states, is_split):
+        self._chunks.append((times, states, is_split))
+
+    def close(self):
+        if not self._chunks:
+            return TimepointData(np.empty(0), np.empty((0, 3)), np.empty(0, dtype=bool))
+        times, states, is_split = (np.concatenate(parts) for parts in zip(*self._chunks))
+        return TimepointData(times, states, is_split)
+
+
+class FileSink:
+    """
+    Streams the chunks of a trajectory to filename in io's trajectory folder,
+    as float64 rows (time, m, h, u, is_split); close returns filename, to be read with read_trajectory.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(io.get_trajectory_path(filename), "wb")  # pylint:disable=consider-using-with
+
+    def write(self, times, states, is_split):
+        np.column_stack([times, states, is_split]).astype(np.float64).tofile(self._file)
+
+    def close(self):
+        self._file.close()
+        return self.filename
+
+
+class DecimatingSink:
+    """
+    Passes a thinned trajectory on to target, keeping in each bucket of bucket_duration time
+    its first and last points and the points where m, h or u reach their minimum or maximum.
+    Splits and the points just before them are always kept, so the jumps stay sharp.
+    At most one bucket is held back between chunks.
+    """
+
+    def __init__(self, target, bucket_duration):
+        self.target = target
+        self.bucket_duration = bucket_duration
+        self._pending = None
+
+    def write(self, times, states, is_split):
+        if self._pending is not None:
+            times, states, is_split = (np.concatenate(parts) for parts in zip(self._pending, (times, states, is_split)))
+        buckets = np.floor(times / self.bucket_duration)
+        complete = buckets < buckets[-1]
+        # the last point of the complete buckets may precede the first split of the pending one
+        before_split = np.append(is_split[1:], False)
+        self._write_buckets(times[complete], states[complete], is_split[complete],
+                            before_split[complete], buckets[complete])
+        self._pending = (times[~complete], states[~complete], is_split[~complete])
+
+    def close(self):
+        if self._pending is not None:
+            times, states, is_split = self._pending
+            self._write_buckets(times, states, is_split, np.append(is_split[1:], False),
+                                np.floor(times / self.bucket_duration))
+        return self.target.close()
+
+    def _write_buckets(self, times, states, is_split, before_split, buckets):
+        if len(times) == 0:
+            return
+        starts = np.flatnonzero(np.diff(buckets, prepend=-np.inf))
+        counts = np.diff(np.append(starts, len(times)))
+        kept = is_split | before_split
+        kept[starts] = True
+        kept[starts + counts - 1] = True
+        for reduce in (np.minimum, np.maximum):
+            kept |= (states == np.repeat(reduce.reduceat(states, starts), counts, axis=0)).any(axis=1)
+        self.target.write(times[kept], states[kept], is_split[kept])
+
+
+def read_trajectory(filename):
+    """Returns the TimepointData of a trajectory streamed to filename by a FileSink."""
+    rows = io.read_trajectory(filename, COLUMN_COUNT)
+    return TimepointData(rows[:, 0], rows[:, 1:4], rows[:, 4].astype(bool))
@@ -0,0 +1,114 @@
+"""
+This module contains the transfer operator of the PDMP, a deterministic alternative
+to long simulations for where the PDMP spends its time.
+
+Just after a division the state is (0, h, 1 - h), so the states at division times form
+a Markov chain on h in [0, 1]. Its transition kernel is a flow for an exponential time
+followed by the split, h' = (2m + h) / 2. Discretizing h into cells turns the kernel into a
+sparse stochastic matrix, and sparse linear algebra then gives the stationary and transient
+distributions, the occupation of the simplex and the rate of switching between basins.
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.linalg import eigs
+
+
+class TransferOperator:
+    """
+    Markov chain of the hemimethylated fraction h just after each division, on cell_count even cells of [0, 1].
+        - matrix[i, j] is the probability that a cell starting from the center of cell i
+          has h in cell j just after its next division (mass is split linearly between neighboring centers).
+        - occupation[i] is the distribution of the time until that division over histogram bins of (m, h),
+          weighted as a fraction of the expected time between divisions.
+    """
+
+    def __init__(self, matrix, occupation, birth_rate, bin_count):
+        self.matrix = matrix.tocsr()
+        self.occupation = occupation.tocsr()
+        self.birth_rate = birth_rate
+        self.bin_count = bin_count
+        self.cell_count = self.matrix.shape[0]
+        self.cell_centers = (np.arange(self.cell_count) + 0.5) / self.cell_count
+        self._stationary = None
+
+    @classmethod
+    def from_trajectories(cls, starts, times, trajectories, birth_rate, bin_count=100):
+        """
+        Builds the operator from trajectories of the flow, where trajectories[i, k] is the (m, h, u) state
+        at times[k] on the trajectory from (0, starts[i], 1 - starts[i]), one start per cell center.
+        Each interval between samples holds the probability that the division falls in it,
+        and the mass beyond the last sample divides at the last state.
+        """
+        cell_count = len(starts)
+        survival = np.exp(-birth_rate * np.asarray(times))
+        weights = np.append(survival[:-1] - survival[1:], survival[-1])
+        # the state over each interval is represented by its midpoint
+        states = np.concatenate([(trajectories[:, :-1] + trajectories[:, 1:]) / 2, trajectories[:, -1:]], axis=1)
+        rows = np.repeat(np.arange(cell_count), len(weights))
+        flat_weights = np.tile(weights, cell_count)
+        m, h = states[:, :, 0].ravel(), states[:, :, 1].ravel()
+
+        # split h' = m + h / 2 between the two nearest cell centers
+        position = np.clip((m + h / 2) * cell_count - 0.5, 0, cell_count - 1)
+        left = np.minimum(np.floor(position).astype(int), cell_count - 2)
+        fraction = position - left
+        matrix = coo_matrix((np.concatenate([flat_weights * (1 - fraction), flat_weights * fraction]),
+                             (np.concatenate([rows, rows]), np.concatenate([left, left + 1]))),
+                            shape=(cell_count, cell_count))
+
+        m_bins = np.clip((m * bin_count).astype(int), 0, bin_count - 1)
+        h_bins = np.clip((h * bin_count).astype(int), 0, bin_count - 1)
+        occupation = coo_matrix((flat_weights, (rows, m_bins * bin_count + h_bins)),
+                                shape=(cell_count, bin_count ** 2))
+        return cls(matrix, occupation, birth_rate, bin_count)
+
+    def get_stationary_distribution(self):
+        """Returns the stationary distribution of h just after divisions, over the cells."""
+        if self._stationary is None:
+            self._stationary = self._get_leading_eigenvectors(1)[1][:, 0]
+        return self._stationary
+
+    def get_transient_distribution(self, initial_distribution, division_count):
+        """Returns the distribution of h over the cells after division_count divisions."""
+        distribution = np.asarray(initial_distribution, dtype=float)
+        for _ in range(division_count):
+            distribution = self.matrix.T @ distribution
+        return distribution
+
+    def get_occupation_histogram(self, distribution=None):
+        """
+        Returns the (bin_count, bin_count) histogram over (m, h) of the fraction of time spent in each bin
+        during one division cycle started from distribution (by default the stationary distribution),
+        which in the stationary case is the long run occupation of the simplex.
+        """
+        if distribution is None:
+            distribution = self.get_stationary_distribution()
+        return (self.occupation.T @ distribution).reshape(self.bin_count, self.bin_count)
+
+    def get_switching_rates(self, threshold=1):
+        """
+        Returns a dictionary of the rates of switching between the unmethylated (2m + h < threshold)
+        and methylated (2m + h >= threshold) basins, with the stationary methylated fraction.
+        The number of divisions by time t is Poisson, so the second eigenvalue l of the matrix relaxes
+        distributions at rate b (1 - l), which the two state reduction splits in proportion to the basin sizes.
+        """
+        eigenvalues, _ = self._get_leading_eigenvectors(2)
+        relaxation_rate = self.birth_rate * (1 - np.real(eigenvalues[1]))
+        histogram = self.get_occupation_histogram()
+        centers = (np.arange(self.bin_count) + 0.5) / self.bin_count
+        methylation = 2 * centers[:, None] + centers[None, :]
+        methylated_fraction = histogram[methylation >= threshold].sum() / histogram.sum()
+        return {
+            "relaxation_rate": relaxation_rate,
+            "methylated_fraction": methylated_fraction,
+            "r_um": relaxation_rate * methylated_fraction,
+            "r_mu": relaxation_rate * (1 - methylated_fraction),
+        }
+
+    def _get_leading_eigenvectors(self, count):
+        """Returns the count eigenvalues of largest modulus, with left eigenvectors normalized to distributions."""
+        eigenvalues, eigenvectors = eigs(self.matrix.T, k=count + 1, which="LM")
+        order = np.argsort(-np.abs(eigenvalues))[:count]
+        eigenvectors = np.real(eigenvectors[:, order])
+        return eigenvalues[order], eigenvectors / eigenvectors.sum(axis=0)
@@ -0,0 +1,81 @@
+"""
+This module accumulates Monte Carlo estimates without storing the samples.
+
+RunningMoments keeps the per-coordinate mean and sum of squared deviations of streamed samples
+(Welford's update, in Chan's form for whole blocks of samples), so blocks computed separately,
+for example by different processes, can be merged exactly. Samples may come with a control variate,
+a correlated quantity of known expectation, which removes the correlated part of the variance.
+"""
+
+import numpy as np
+from scipy.stats import norm
+
+
+class RunningMoments:
+    """
+    Running mean and variance of samples of a size-long vector, with an optional control variate.
+        - update(samples, controls) adds an (n, size) block of samples and their controls.
+        - merge(other) adds the samples of another RunningMoments.
+        - get_estimate and get_confidence_band give the (controlled) mean and its uncertainty.
+    """
+
+    def __init__(self, size):
+        self.count = 0
+        self.mean = np.zeros(size)
+        self.control_mean = np.zeros(size)
+        self._squares = np.zeros(size)
+        self._control_squares = np.zeros(size)
+        self._products = np.zeros(size)
+
+    def update(self, samples, controls=None):
+        """Adds an (n, size) array of samples, and controls of the same shape if a control variate is used."""
+        samples = np.asarray(samples, dtype=float)
+        controls = np.zeros_like(samples) if controls is None else np.asarray(controls, dtype=float)
+        block = RunningMoments(samples.shape[1])
+        block.count = len(samples)
+        block.mean = samples.mean(axis=0)
+        block.control_mean = controls.mean(axis=0)
+        deviations = samples - block.mean
+        control_deviations = controls - block.control_mean
+        block._squares = (deviations ** 2).sum(axis=0)
+        block._control_squares = (control_deviations ** 2).sum(axis=0)
+        block._products = (deviations * control_deviations).sum(axis=0)
+        self.merge(block)
+
+    def merge(self, other):
+        """Adds the samples summarized by other."""
+        count = self.count + other.count
+        if other.count == 0:
+            return
+        weight = self.count * other.count / count
+        delta = other.mean - self.mean
+        control_delta = other.control_mean - self.control_mean
+        self.mean = self.mean + delta * other.count / count
+        self.control_mean = self.control_mean + control_delta * other.count / count
+        self._squares = self._squares + other._squares + delta ** 2 * weight
+        self._control_squares = self._control_squares + other._control_squares + control_delta ** 2 * weight
+        self._products = self._products + other._products + delta * control_delta * weight
+        self.count = count
+
+    def get_variance(self):
+        """Returns the sample variance of each coordinate."""
+        return self._squares / max(self.count - 1, 1)
+
+    def get_estimate(self, control_expectation=None):
+        """
+        Returns (estimate, standard_error) of the mean. With the expectation of the control variate,
+        the estimate is corrected by the regression of the samples on their controls.
+        """
+        if control_expectation is None:
+            return self.mean, np.sqrt(self.get_variance() / max(self.count, 1))
+        slope = np.divide(self._products, self._control_squares, out=np.zeros_like(self._products),
+                          where=self._control_squares > 0)
+        estimate = self.mean - slope * (self.control_mean - control_expectation)
+        residual_variance = np.maximum(self._squares - slope * self._products, 0) / max(self.count - 2, 1)
+        return estimate, np.sqrt(residual_variance / max(self.count, 1))
+
+    def get_confidence_band(self, confidence=0.95, control_expectation=None):
+        """Returns (estimate, low, high), with [low, high] a normal confidence interval at level confidence."""
+        estimate, standard_error = self.get_estimate(control_expectation)
+        half_width = norm.ppf((1 + confidence) / 2) * standard_error
+        return estimate, estimate - half_width, estimate + half_width
@@ -0,0 +1,88 @@
+"""Validates the agent-based model against the one dimensional and site-state collaborative means."""
+
+# pylint:disable=missing-function-docstring
+import numpy as np
+
+from src.tools.models.agent import AgentBasedCollaborative, HEMIMETHYLATED, METHYLATED
+from src.tools.models.methylation import OneDimensionalCollaborative, SiteStateCollaborative
+
+# fast hemimethylated transitions, so that the one dimensional reduction applies
+PARAMETERS = {
+    'b_0': 0,
+    'b_M': 0,
+    'd_0': 0.3,
+    'd_M': 0.1,
+    'r_uh': 0.3,
+    'r_hm': 20,
+    'r_mh': 0.3,
+    'r_hu': 20,
+    'r_uh_h': 0,
+    'r_uh_m': 1,
+    'r_hm_h': 0,
+    'r_hm_m': 5,
+    'r_mh_h': 0,
+    'r_mh_u': 1,
+    'r_hu_h': 0,
+    'r_hu_u': 5,
+}
+
+
+def test_agent_matches_one_dimensional_mean():
+    M = 6
+    cell_count = 5000
+    model = AgentBasedCollaborative(M)
+    sites = model.run(PARAMETERS, model.get_initial_state(cell_count, methylated_count=3), 1)
+    simulated = model.get_methylated_distribution(sites)
+
+    initial_state = [0] * (M + 1)
+    initial_state[3] = cell_count
+    mean = OneDimensionalCollaborative(M).get_deterministic_model().run(PARAMETERS, initial_state, 1)
+    assert abs(simulated.sum() - sum(mean)) < 0.03 * cell_count
+    levels = np.arange(M + 1)
+    assert abs(simulated @ levels / simulated.sum() - levels @ mean / sum(mean)) < 0.1
+
+
+def test_agent_matches_site_state_mean():
+    # methylation-dependent fitness and hemimethylation-mediated switches
+    parameters = {
+        'b_0': 1,
+        'b_M': 2,
+        'd_0': 1,
+        'd_M': 0.5,
+        'r_uh': 0.3,
+        'r_hm': 0.5,
+        'r_mh': 0.2,
+        'r_hu': 0.4,
+        'r_uh_h': 0.5,
+        'r_uh_m': 1,
+        'r_hm_h': 1,
+        'r_hm_m': 2,
+        'r_mh_h': 0.3,
+        'r_mh_u': 0.5,
+        'r_hu_h': 0.3,
+        'r_hu_u': 1,
+    }
+    M = 4
+    cell_count = 5000
+    model = AgentBasedCollaborative(M)
+    initial_state = model.get_initial_state(cell_count, methylated_count=2, hemimethylated_count=1)
+    sites = model.run(parameters, initial_state, 1, rng=np.random.default_rng(0))
+    simulated = model.get_counts(sites).sum(axis=0)
+
+    site_state_model = SiteStateCollaborative(M)
+    mean = site_state_model.get_deterministic_model().run(
+        parameters, site_state_model.to_dense({(1, 1, 2): cell_count}), 1)
+    expected = np.array(mean) @ np.array(site_state_model.types)
+    assert np.all(np.abs(simulated - expected) < 0.04 * expected)
+
+
+def test_division_splits_hemimethylated_sites():
+    model = AgentBasedCollaborative(8)
+    # a single step so short that switches are negligible while the division is certain
+    parameters = dict(PARAMETERS, b_0=1e12, b_M=1e12, d_0=0, d_M=0)
+    parent = model.get_initial_state(1, methylated_count=4, hemimethylated_count=4)
+    daughters = model.run(parameters, parent, 1e-9, rng=np.random.default_rng(0))
+    assert len(daughters) == 2
+    assert (daughters[:, :4] == HEMIMETHYLATED).all()
+    assert ((daughters[:, 4:] == HEMIMETHYLATED).sum(axis=0) == 1).all()
+    assert not (daughters == METHYLATED).any()
@@ -0,0 +1,43 @@
+"""Tests the equilibria of the mean-field approximation of the PDMP."""
+
+# pylint:disable=missing-function-docstring
+import numpy as np
+from src.tools.models import bifurcation
+from src.tools.models.pdmp import PDMP
+from src.constants import BISTABLE_STRONG_PDMP_PARAMS
+
+ZERO_RATES = {name: 0 for name in BISTABLE_STRONG_PDMP_PARAMS}
+
+
+def test_bistable_parameters_have_two_stable_classes():
+    equilibria = bifurcation.find_equilibria(BISTABLE_STRONG_PDMP_PARAMS)
+    assert [equilibrium["stable"] for equilibrium in equilibria] == [True, False, True]
+    mean_field_flow, _ = bifurcation.get_mean_field_flow(BISTABLE_STRONG_PDMP_PARAMS)
+    for equilibrium in equilibria:
+        assert np.isclose(equilibrium["state"].sum(), 1)
+        assert np.allclose(mean_field_flow(equilibrium["state"][None, :2]), 0, atol=1e-9)
+    assert bifurcation.is_mean_field_bistable(BISTABLE_STRONG_PDMP_PARAMS)
+    assert not bifurcation.is_mean_field_bistable(PDMP.convert_to_noncollaborative(BISTABLE_STRONG_PDMP_PARAMS))
+
+
+def test_continuation_turns_at_the_fold():
+    methylated = bifurcation.find_equilibria(BISTABLE_STRONG_PDMP_PARAMS)[-1]
+    branch = bifurcation.continue_equilibrium(BISTABLE_STRONG_PDMP_PARAMS, "r_hm_m", methylated["state"], 0, step=0.5)
+    fold = np.argmin(branch["parameter"])
+    assert 0 < fold < len(branch["parameter"]) - 1
+    assert branch["stable"][:fold - 1].all() and not branch["stable"][fold + 1:].any()
+    below, above = dict(BISTABLE_STRONG_PDMP_PARAMS), dict(BISTABLE_STRONG_PDMP_PARAMS)
+    below["r_hm_m"] = branch["parameter"][fold] - 0.1
+    above["r_hm_m"] = branch["parameter"][fold] + 0.1
+    assert not bifurcation.is_mean_field_bistable(below) and bifurcation.is_mean_field_bistable(above)
+
+
+def test_singular_starts_are_dropped():
+    # without divisions or other rates every state with u = 0 is an equilibrium, so the Jacobian is singular
+    parameters = dict(ZERO_RATES, r_uh=1)
+    assert bifurcation.find_equilibria(parameters) == []
+    branch = bifurcation.continue_equilibrium(parameters, "r_uh", [0, 1, 0], 2)
+    assert len(branch["parameter"]) == 0
+    parameters["r_hm"] = 1
+    equilibria = bifurcation.find_equilibria(parameters)
+    assert len(equilibria) == 1 and np.allclose(equilibria[0]["state"], [1, 0, 0])
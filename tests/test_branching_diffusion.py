@@ -0,0 +1,160 @@
+"""Tests the continuous-type branching diffusion models."""
+
+# pylint:disable=missing-function-docstring
+import random
+
+import numpy as np
+import pytest
+from scipy.integrate import odeint
+
+from src.tools.models.methylation import (BranchingDiffusion, InfiniteSiteOneDimensional,
+                                          OneDimensionalNonCollaborative, _FenwickTree)
+from src.tools.models.flow import FlowMap
+from src.constants import LIVING_BIRTHRATE_PARAMS
+
+
+def test_closed_form_flow_matches_flow_map():
+    model = OneDimensionalNonCollaborative.get_limit_model()
+    general_model = InfiniteSiteOneDimensional(model._r_b, model._r_d, model._r_um, model._r_mu)
+    cell_types = np.array([0, 0.25, 0.8, 1])
+    exact = model.flow(cell_types, 1.3, LIVING_BIRTHRATE_PARAMS)
+    interpolated = general_model.flow(cell_types, 1.3, LIVING_BIRTHRATE_PARAMS)
+    assert np.abs(exact - interpolated).max() < 1e-5
+
+
+def test_flow_map_with_several_equilibria():
+    def f(x):
+        return 3 * (x - 0.2) * (x - 0.5) * (0.9 - x)
+    flow_map = FlowMap(f)
+    xs = np.linspace(0, 1, 21)
+    for duration in [0.01, 0.7, 40]:
+        expected = [odeint(lambda y, t: f(y), x, [0, duration], rtol=1e-12, atol=1e-14)[1][0] for x in xs]
+        assert np.abs(flow_map(xs, duration) - expected).max() < 1e-5
+
+
+def test_clock_engine_without_events_only_flows():
+    model = OneDimensionalNonCollaborative.get_limit_model()
+    parameters = dict(LIVING_BIRTHRATE_PARAMS, b_0=0, b_M=0, d_0=0, d_M=0)
+    final_state = model.run(parameters, {0.8: 3, 0.2: 2}, 2, engine="clock")
+    expected = model.flow(np.array([0.2, 0.8]), 2, parameters)
+    assert sorted(final_state.values()) == [2, 3]
+    assert np.abs(np.array(sorted(final_state.keys())) - expected).max() < 1e-12
+
+
+def test_thinning_engine_matches_the_mean_population():
+    _check_mean_population("thinning")
+
+
+def test_clock_engine_matches_the_mean_population():
+    _check_mean_population("clock")
+
+
+def _check_mean_population(engine):
+    random.seed(3)
+    model = OneDimensionalNonCollaborative.get_limit_model()
+    parameters = dict(LIVING_BIRTHRATE_PARAMS, b_0=1.2, b_M=2, d_0=1, d_M=1.5)
+    density_model = model.get_deterministic_model()
+    expected = np.array(density_model.run(parameters, {0.8: 20}, 2))
+    run_count = 1000
+    sizes, masses = np.zeros(run_count), np.zeros(run_count)
+    for i in range(run_count):
+        final_state = model.run(parameters, {0.8: 20}, 2, engine=engine)
+        sizes[i] = sum(final_state.values())
+        masses[i] = sum(cell_type * count for cell_type, count in final_state.items())
+    # the mean cell count and total methylation agree with the density model within 4 standard errors
+    for samples, mean in [(sizes, expected.sum()), (masses, expected @ density_model.bin_centers)]:
+        assert abs(samples.mean() - mean) < 4 * samples.std() / np.sqrt(run_count)
+
+
+def test_fenwick_tree_finds_prefix_positions():
+    rng = np.random.default_rng(1)
+    counts = rng.integers(0, 4, 37)
+    tree = _FenwickTree(counts)
+    for index, delta in zip(rng.integers(0, 37, 50), rng.integers(-1, 3, 50)):
+        delta = max(delta, -counts[index])
+        counts[index] += delta
+        tree.add(int(index), int(delta))
+    assert tree.to_list() == counts.tolist()
+    assert tree.total == counts.sum()
+    assert tree.empty_count == (counts == 0).sum()
+    # find inverts the prefix sums, landing on the entry that contains each position
+    positions = np.arange(counts.sum())
+    expected = np.searchsorted(np.cumsum(counts), positions, side="right")
+    assert [tree.find(position) for position in positions] == expected.tolist()
+
+
+def test_dropping_empty_types_keeps_the_population():
+    cell_types = np.array([0.1, 0.2, 0.3, 0.4, 0.5])
+    counts = _FenwickTree([2, 0, 0, 3, 0])
+    kept_types, kept_counts = BranchingDiffusion._drop_empty_types(cell_types, counts)
+    assert kept_types.tolist() == [0.1, 0.4]
+    assert kept_counts.to_list() == [2, 3]
+    assert kept_counts.empty_count == 0
+    assert [kept_counts.find(position) for position in range(5)] == [0, 0, 1, 1, 1]
+
+
+def test_density_model_matches_characteristics():
+    model = OneDimensionalNonCollaborative.get_limit_model()
+    density_model = model.get_deterministic_model()
+    parameters = LIVING_BIRTHRATE_PARAMS
+    counts = density_model.run(parameters, {0.8: 10}, 10)
+
+    # a single characteristic: x(t) relaxes exponentially and mass grows at rate b(x) - d(x)
+    times = np.linspace(0, 10, 100001)
+    xs = model.flow(np.full(len(times), 0.8), times, parameters)
+    growth = xs * (parameters["b_M"] - parameters["d_M"]) + (1 - xs) * (parameters["b_0"] - parameters["d_0"])
+    expected = 10 * np.exp(np.sum((growth[1:] + growth[:-1]) / 2 * np.diff(times)))
+    assert abs(sum(counts) - expected) < 1e-3 * expected
+
+
+def test_density_model_needs_two_bins():
+    model = OneDimensionalNonCollaborative.get_limit_model()
+    with pytest.raises(ValueError):
+        model.get_deterministic_model(bin_count=1)
+
+
+def test_extinction_without_methylation_dependence():
+    model = OneDimensionalNonCollaborative.get_limit_model()
+    parameters = dict(LIVING_BIRTHRATE_PARAMS, b_0=2, b_M=2, d_0=1, d_M=1)
+    extinction = model.solve_extinction(parameters)
+    assert np.abs(extinction(np.linspace(0, 1, 11)) - 0.5).max() < 1e-9
+
+
+def test_extinction_matches_shooting_from_the_equilibrium():
+    model = OneDimensionalNonCollaborative.get_limit_model()
+    parameters = LIVING_BIRTHRATE_PARAMS
+    def f(x):
+        return model.diffusion(x, parameters)
+    def b(x):
+        return model._r_b(x, parameters)
+    def d(x):
+        return model._r_d(x, parameters)
+
+    # the regular solution passes through min(d / b, 1) where the diffusion vanishes, with the slope from
+    # differentiating f y' = - (d - b y)(1 - y) there, and is shot outward from just beside that point
+    x_0 = parameters["r_um"] / (parameters["r_um"] + parameters["r_mu"])
+    y_0 = min(d(x_0) / b(x_0), 1)
+    delta = 1e-6
+    df, db, dd = ((g(x_0 + delta) - g(x_0 - delta)) / (2 * delta) for g in (f, b, d))
+    slope = - (dd - db * y_0) * (1 - y_0) / (df - b(x_0) * (1 - y_0))
+    def derivative(y, x):
+        return - (d(x) - b(x) * y) * (1 - y) / f(x)
+    offset = 1e-3
+    low = np.linspace(x_0 - offset, 0, 50)
+    high = np.linspace(x_0 + offset, 1, 50)
+    expected_low = odeint(derivative, y_0 - slope * offset, low, rtol=1e-12, atol=1e-12)[:, 0]
+    expected_high = odeint(derivative, y_0 + slope * offset, high, rtol=1e-12, atol=1e-12)[:, 0]
+
+    extinction = model.solve_extinction(parameters)
+    assert np.abs(extinction(low) - expected_low).max() < 1e-5
+    assert np.abs(extinction(high) - expected_high).max() < 1e-5
+    assert np.ptp(np.concatenate([expected_low, expected_high])) > 0.1
+
+
+def test_extinction_warm_start():
+    model = OneDimensionalNonCollaborative.get_limit_model()
+    parameters = dict(LIVING_BIRTHRATE_PARAMS, r_mu=0.1, r_um=0.2)
+    cold = model.solve_extinction(parameters)
+    warm = model.solve_extinction(dict(parameters, r_mu=0.11), initial_guess=cold)
+    assert np.abs(warm(np.linspace(0, 1, 11)) - cold(np.linspace(0, 1, 11))).max() < 0.05
+    assert np.all(warm(np.linspace(0, 1, 11)) <= 1 + 1e-9)
@@ -0,0 +1,42 @@
+"""Tests the parameter exploration pipeline."""
+
+# pylint:disable=missing-function-docstring
+import numpy as np
+from src.tools import io
+from src.tools.models import exploration
+
+
+def test_statistics_ignore_short_dips_and_stretches():
+    times = np.arange(0, 100, 0.5)
+    methylated = np.zeros((3, len(times)))
+    methylated[0, (times >= 10) & (times < 40)] = 1
+    methylated[0, (times >= 20) & (times < 21)] = 0
+    methylated[1, (times >= 50) & (times < 55)] = 1
+    methylated[2, times >= 30] = 1
+    statistics = exploration.get_bistability_statistics(times, methylated)
+    assert statistics["switch_count"].tolist() == [2, 0, 1]
+    assert np.allclose(statistics["methylated_fraction"], [30 / 99.5, 0, 69.5 / 99.5])
+    assert np.isnan(statistics["r_mu"][1]) and statistics["r_mu"][2] == 0
+
+
+def test_exploration_writes_one_row_per_set(tmp_path, monkeypatch):
+    monkeypatch.setattr(io, "BASE_PATH", str(tmp_path))
+    (tmp_path / io.EXPLORATION_PATH).mkdir()
+    parameter_sets = exploration.sample_parameters(5, method="latin", seed=2)
+    times = np.linspace(0, 20, 81)
+    count = exploration.explore(parameter_sets, "test", times, chunk_size=2, worker_count=2, seed=1)
+    table = io.read_exploration("test")
+    assert count == 5 and len(table["r_uh"]) == 5
+    assert np.allclose(table["r_hm_m"], [parameters["r_hm_m"] for parameters in parameter_sets])
+    assert set(exploration.STATISTICS) <= set(table)
+    assert np.all((0 <= table["methylated_fraction"]) & (table["methylated_fraction"] <= 1))
+
+    # a rerun replaces the file, and resuming only runs the missing chunks
+    exploration.explore(parameter_sets, "test", times, chunk_size=2, worker_count=2, seed=1)
+    assert len(io.read_exploration("test")["r_uh"]) == 5
+    exploration.explore(parameter_sets[:4], "partial", times, chunk_size=2, worker_count=2, seed=1)
+    resumed = exploration.explore(parameter_sets, "partial", times, chunk_size=2, worker_count=2, seed=1,
+                                  resume=True)
+    assert resumed == 1
+    partial = io.read_exploration("partial")
+    assert all(np.array_equal(partial[column], table[column], equal_nan=True) for column in table)
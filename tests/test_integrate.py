@@ -0,0 +1,33 @@
+"""Tests the batched integrator of piecewise deterministic flows."""
+
+# pylint:disable=missing-function-docstring
+import numpy as np
+
+from src.tools.models.integrate import integrate_batch
+
+
+def test_decay_with_jumps():
+    # x' = -r x with x -> x + 1 at each jump, one decay rate and set of jump times per row
+    rates = np.array([0.5, 2, 40])
+    jump_times = [[0.3, 1.2], [], [0.5]]
+    times = [0, 0.3, 1, 2]
+    result = integrate_batch(lambda x, rows: -rates[rows, None] * x,
+                             lambda x, rows: -rates[rows, None, None] * np.ones((len(rows), 1, 1)),
+                             np.ones((3, 1)), times, jump_times=jump_times, jump=lambda x, rows: x + 1)
+    for row, rate in enumerate(rates):
+        for i, time in enumerate(times):
+            expected = np.exp(-rate * time) + sum(np.exp(-rate * (time - jump))
+                                                  for jump in jump_times[row] if jump <= time)
+            assert abs(result[row, i, 0] - expected) < 1e-5
+
+
+def test_dense_output_between_steps():
+    # output times much closer together than the steps are interpolated rather than stepped to
+    evaluations = []
+    def f(x, rows):
+        evaluations.append(len(rows))
+        return -x
+    times = np.linspace(0, 1, 1001)
+    result = integrate_batch(f, lambda x, rows: -np.ones((len(rows), 1, 1)), [[1.0]], times)
+    assert np.allclose(result[0, :, 0], np.exp(-times), atol=1e-6)
+    assert len(evaluations) < len(times)
@@ -1,3 +1,6 @@
+import numpy as np
+from scipy.linalg import expm
+
 from src.tools.models import methylation
 
 def test_1d_birth_1():
@@ -56,4 +59,36 @@ def test_noncoll_demethylation_2():
     event = methylation.OneDimensionalNonCollaborativeDemethylation(2, 4)
     state = [1, 0, 2, 0, 0]
     event.implement(state)
-    assert state == [1, 1, 1, 0, 0]
\ No newline at end of file
+    assert state == [1, 1, 1, 0, 0]
+
+
+def test_birth_shift():
+    event = methylation.BirthShift()
+    state = [3, 5, 2]
+    event.implement(state)
+    assert sum(state) == 10
+    assert state[2] == 0
+    assert 3 <= state[0] <= 8
+
+
+def test_single_cell_batch_mean():
+    parameters = {"r_uh": 0.1, "r_hu": 0.1, "r_hm": 1, "r_mh": 0.1, "b": 0.5}
+    model = methylation.NoncollaborativeSingleCell()
+    rng = np.random.default_rng(0)
+    initial_states = np.tile([100, 0, 0], (2000, 1))
+    states = model.run_batch(parameters, initial_states, 5, rng=rng)
+    data = model.generate_batch_timepoint_data(parameters, initial_states, [1, 5], rng=rng)
+
+    # the expected fractions of sites (u, h, m) follow the site generator plus the average effect of splits
+    site_generator = np.array([
+        [-parameters["r_uh"], parameters["r_uh"], 0],
+        [parameters["r_hu"], -parameters["r_hu"] - parameters["r_hm"], parameters["r_hm"]],
+        [0, parameters["r_mh"], -parameters["r_mh"]],
+    ])
+    split = np.array([[1, 0, 0], [0.5, 0.5, 0], [0, 1, 0]])
+    def get_mean(time):
+        return np.array([100, 0, 0]) @ expm(time * (site_generator + parameters["b"] * (split - np.eye(3))))
+    assert (states.sum(axis=1) == 100).all()
+    assert np.abs(states.mean(axis=0) - get_mean(5)).max() < 2
+    for k, time in enumerate([1, 5]):
+        assert np.abs(data[:, k].mean(axis=0) - get_mean(time)).max() < 2
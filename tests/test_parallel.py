@@ -0,0 +1,28 @@
+"""Tests running PDMP samples in several processes."""
+
+# pylint:disable=missing-function-docstring
+import numpy as np
+from src.tools.models import parallel
+from src.tools.models.pdmp import PDMP
+from src.constants import BISTABLE_STRONG_PDMP_PARAMS
+
+
+def test_parallel_wasserstein_is_reproducible():
+    parameters = PDMP.convert_to_noncollaborative(BISTABLE_STRONG_PDMP_PARAMS)
+    times = [0, 0.5, 1]
+    first, _ = parallel.estimate_wasserstein(parameters, times, relative_error=0, max_sample_count=300,
+                                             round_sample_count=50, control_variate=False, worker_count=2, seed=7)
+    second, _ = parallel.estimate_wasserstein(parameters, times, relative_error=0, max_sample_count=300,
+                                              round_sample_count=50, control_variate=False, worker_count=2, seed=7)
+    assert first.count == 300
+    assert np.array_equal(first.mean, second.mean)
+    expected = PDMP.get_linear_coupled_distance(parameters, times)
+    estimate, low, high = first.get_confidence_band(0.999)
+    assert np.all((low <= expected + 1e-12) & (expected - 1e-12 <= high))
+
+
+def test_parallel_ensemble_keeps_the_simplex():
+    moments = parallel.sample_ensemble(BISTABLE_STRONG_PDMP_PARAMS, [0, 0, 1], [0, 1, 2], 40,
+                                       chunk_size=15, worker_count=2, seed=3)
+    assert moments.count == 40
+    assert np.allclose(moments.mean.reshape(3, 3).sum(axis=1), 1)
@@ -0,0 +1,204 @@
+"""Tests the piecewise deterministic methylation model."""
+
+# pylint:disable=missing-function-docstring
+import random
+import numpy as np
+import pytest
+from scipy.integrate import odeint, solve_ivp
+
+from src.tools import io
+from src.tools.models.pdmp import PDMP
+from src.constants import BISTABLE_PDMP_PARAMS, BISTABLE_STRONG_PDMP_PARAMS
+
+ZERO_RATES = {name: 0 for name in BISTABLE_STRONG_PDMP_PARAMS}
+
+
+def test_flow_noncollaborative_rate():
+    parameters = dict(ZERO_RATES, r_hm=1)
+    assert np.allclose(PDMP.flow(parameters)(0, [0, 1, 0]), [1, -1, 0])
+
+
+def test_flow_collaborative_rate():
+    parameters = dict(ZERO_RATES, r_uh_m=2)
+    assert np.allclose(PDMP.flow(parameters)(0, [0.5, 0, 0.5]), [0, 0.5, -0.5])
+
+
+def test_flow_on_batches():
+    flow = PDMP.flow(BISTABLE_STRONG_PDMP_PARAMS)
+    states = np.random.default_rng(0).dirichlet([1, 1, 1], size=20)
+    batch = flow(0, states)
+    assert np.allclose(batch, [flow(0, state) for state in states])
+    assert np.abs(batch.sum(axis=1)).max() < 1e-12
+
+
+def test_jacobian_matches_finite_differences():
+    flow = PDMP.flow(BISTABLE_STRONG_PDMP_PARAMS)
+    jacobian = PDMP.jacobian(BISTABLE_STRONG_PDMP_PARAMS)
+    state = np.array([0.2, 0.3, 0.5])
+    step = 1e-6
+    differences = np.array([(flow(0, state + step * e) - flow(0, state - step * e)) / (2 * step)
+                            for e in np.eye(3)]).T
+    assert np.allclose(jacobian(0, state), differences, atol=1e-6)
+    assert np.allclose(jacobian(0, np.array([state, state]))[1], differences, atol=1e-6)
+
+
+def _integrate_segments(parameters, initial_state, times, splitting_times):
+    """Reference solution restarting a tight odeint at each split."""
+    flow = PDMP.flow(parameters)
+    state = np.array(initial_state, dtype=float)
+    result = {}
+    previous = 0
+    for time in sorted(set(times) | set(splitting_times)):
+        state = odeint(flow, state, [previous, time], tfirst=True, rtol=1e-12, atol=1e-12)[-1]
+        if time in splitting_times:
+            state = np.array([0, state[0] + state[1] / 2, state[1] / 2 + state[2]])
+        result[time] = state
+        previous = time
+    return result
+
+
+def test_timepoint_data_across_splits():
+    times = [0, 0.5, 1, 1.5, 2, 3]
+    splitting_times = [0.7, 1.6, 2.2]
+    result = PDMP().generate_timepoint_data(BISTABLE_STRONG_PDMP_PARAMS, [0, 0, 1], times, splitting_times)
+    expected = _integrate_segments(BISTABLE_STRONG_PDMP_PARAMS, [0, 0, 1], times, splitting_times)
+    assert sorted(result) == sorted(expected)
+    for time, state in expected.items():
+        assert np.allclose(result[time], state, atol=1e-6)
+    assert result[1.6][0] == 0
+
+
+def test_batch_with_parameters_per_row():
+    times = [0, 0.5, 1, 2, 3]
+    splitting_times = [0.7, 1.5, 2.2]
+    parameters = [BISTABLE_STRONG_PDMP_PARAMS, BISTABLE_PDMP_PARAMS]
+    initial_states = [[0, 0, 1], [1, 0, 0]]
+    batch = PDMP().generate_batch_timepoint_data(parameters, initial_states, times, splitting_times=splitting_times)
+    for row, (row_parameters, initial_state) in enumerate(zip(parameters, initial_states)):
+        expected = _integrate_segments(row_parameters, initial_state, times, splitting_times)
+        assert np.allclose(batch[row, 1:], [expected[time] for time in times[1:]], atol=1e-6)
+
+
+def test_noncollaborative_parameters_are_solved_exactly():
+    parameters = PDMP.convert_to_noncollaborative(BISTABLE_STRONG_PDMP_PARAMS)
+    assert PDMP.is_linear(parameters) and not PDMP.is_linear(BISTABLE_STRONG_PDMP_PARAMS)
+    times = [0, 0.5, 1, 2, 3]
+    splitting_times = [0.7, 1.6, 2.2]
+    result = PDMP().generate_timepoint_data(parameters, [0, 0, 1], times, splitting_times)
+    expected = _integrate_segments(parameters, [0, 0, 1], times, splitting_times)
+    for time, state in expected.items():
+        assert np.allclose(result[time], state, atol=1e-10)
+
+
+def test_hitting_times_match_event_location():
+    model = PDMP()
+    starts = np.array([0, 0.3, 0.5, 0.9])
+    times = model.get_hitting_times(BISTABLE_STRONG_PDMP_PARAMS, starts, 1.8)
+    flow = PDMP.flow(BISTABLE_STRONG_PDMP_PARAMS)
+    for start, time in zip(starts, times):
+        event = lambda t, x: 2 * x[0] + x[1] - 1.8
+        event.terminal = True
+        solution = solve_ivp(flow, [0, 100], [0, start, 1 - start], method="Radau", events=event, rtol=1e-10, atol=1e-12)
+        assert abs(time - solution.t_events[0][0]) < 1e-5 * max(1, time)
+    assert model.get_hitting_time(BISTABLE_STRONG_PDMP_PARAMS, 0.4, 0.2) == 0
+    assert model.get_hitting_time(BISTABLE_STRONG_PDMP_PARAMS, 0.4, 2.5, max_time=10) == np.inf
+
+
+def test_hitting_time_table_interpolates():
+    model = PDMP()
+    table = model.get_hitting_time_table(BISTABLE_STRONG_PDMP_PARAMS, start_count=51, level_count=101,
+                                         time_count=2001, persist=False)
+    starts = np.array([0.5, 0.7, 0.9, 0.6])
+    levels = np.array([1.8, 1.5, 1.9, 0.3])
+    expected = model.get_hitting_times(BISTABLE_STRONG_PDMP_PARAMS, starts, levels)
+    assert np.allclose(table(starts, levels), expected, atol=1e-2)
+
+
+def test_hitting_time_table_persists(tmp_path, monkeypatch):
+    monkeypatch.setattr(io, "BASE_PATH", str(tmp_path))
+    (tmp_path / io.TABLE_PATH).mkdir()
+    monkeypatch.setattr(PDMP, "_hitting_time_tables", {})
+    grid = dict(start_count=21, level_count=41, time_count=501)
+    starts = np.array([0.5, 0.7, 0.9, 0.6])
+    levels = np.array([1.8, 1.5, 1.9, 0.3])
+    table = PDMP().get_hitting_time_table(BISTABLE_STRONG_PDMP_PARAMS, **grid)
+    assert len(list((tmp_path / io.TABLE_PATH).iterdir())) == 1
+
+    # with the memory cache cleared, the table is read back instead of integrated again
+    monkeypatch.setattr(PDMP, "_hitting_time_tables", {})
+    def fail(*args, **kwargs):
+        raise AssertionError("the table was recomputed")
+    with monkeypatch.context() as patch:
+        patch.setattr(PDMP, "generate_batch_timepoint_data", fail)
+        reloaded = PDMP().get_hitting_time_table(BISTABLE_STRONG_PDMP_PARAMS, **grid)
+    assert np.array_equal(reloaded(starts, levels), table(starts, levels))
+
+    PDMP().get_hitting_time_table(dict(BISTABLE_STRONG_PDMP_PARAMS, b=2), **grid)
+    PDMP().get_hitting_time_table(BISTABLE_STRONG_PDMP_PARAMS, **dict(grid, start_count=11))
+    assert len(list((tmp_path / io.TABLE_PATH).iterdir())) == 3
+
+
+def test_hitting_time_table_checks_the_wasserstein_lemma():
+    parameters = dict(BISTABLE_STRONG_PDMP_PARAMS, r_hu_u=0, r_uh_h=1)
+    with pytest.raises(NotImplementedError):
+        PDMP().get_hitting_time_table(parameters, persist=False)
+
+
+def test_transfer_operator_matches_simulation():
+    parameters = PDMP.convert_to_noncollaborative(BISTABLE_STRONG_PDMP_PARAMS)
+    model = PDMP()
+    operator = model.get_transfer_operator(parameters, cell_count=100, time_count=501, bin_count=50)
+    assert np.allclose(operator.matrix.sum(axis=1), 1)
+    stationary = operator.get_stationary_distribution()
+    assert np.allclose(operator.get_transient_distribution(stationary, 3), stationary)
+    histogram = operator.get_occupation_histogram()
+    assert np.isclose(histogram.sum(), 1)
+
+    # at a late time the states of independent cells follow the occupation distribution
+    random.seed(5)
+    states = model.generate_batch_timepoint_data(parameters, np.tile([0, 0, 1.], (2000, 1)), [0, 50])[:, -1]
+    centers = (np.arange(50) + 0.5) / 50
+    expected = (histogram * (2 * centers[:, None] + centers[None, :])).sum()
+    assert abs((2 * states[:, 0] + states[:, 1]).mean() - expected) < 0.03
+
+
+def test_reduced_flow_matches_full_flow():
+    states = np.random.default_rng(3).dirichlet([1, 1, 1], size=20)
+    flow = PDMP.flow(BISTABLE_STRONG_PDMP_PARAMS)(0, states)
+    reduced_flow = PDMP.reduced_flow(BISTABLE_STRONG_PDMP_PARAMS)(0, states[:, :2])
+    assert np.allclose(reduced_flow, flow[:, :2])
+    jacobian = PDMP.reduced_jacobian(BISTABLE_STRONG_PDMP_PARAMS)(0, states[:, :2])
+    step = 1e-6
+    for j in range(2):
+        shifted = states[:, :2].copy()
+        shifted[:, j] += step
+        difference = (PDMP.reduced_flow(BISTABLE_STRONG_PDMP_PARAMS)(0, shifted) - reduced_flow) / step
+        assert np.allclose(jacobian[:, :, j], difference, atol=1e-4)
+
+    data = PDMP().generate_batch_timepoint_data(BISTABLE_STRONG_PDMP_PARAMS, states, [0, 1, 5], [0.5, 2])
+    assert np.allclose(data.sum(axis=2), 1, rtol=0, atol=1e-14)
+
+
+def test_control_variate_narrows_the_wasserstein_band():
+    times = [0, 0.5, 1]
+    random.seed(4)
+    moments, control_expectation = PDMP().estimate_wasserstein(BISTABLE_PDMP_PARAMS, times, relative_error=0,
+                                                               min_sample_count=500, max_sample_count=500)
+    reference, _ = PDMP().estimate_wasserstein(BISTABLE_PDMP_PARAMS, times, relative_error=0, min_sample_count=3000,
+                                               max_sample_count=3000, chunk_size=1000, control_variate=False)
+    estimate, error = moments.get_estimate(control_expectation)
+    _, plain_error = moments.get_estimate()
+    reference_estimate, reference_error = reference.get_estimate()
+    assert np.all(np.abs(estimate - reference_estimate) <= 4 * np.hypot(error, reference_error) + 1e-12)
+    assert np.all(error[1:] < 0.8 * plain_error[1:])
+
+
+def test_wasserstein_estimate_stops_at_the_absolute_floor():
+    # the distance decays to about 1e-3 by time 5, which a relative error of 1% alone would rarely resolve
+    parameters = PDMP.convert_to_noncollaborative(BISTABLE_STRONG_PDMP_PARAMS)
+    random.seed(5)
+    moments, _ = PDMP().estimate_wasserstein(parameters, [0, 5, 10], relative_error=0.01, absolute_error=0.01,
+                                             max_sample_count=20000, control_variate=False)
+    assert moments.count == 200
+    estimate, _, high = moments.get_confidence_band()
+    assert np.all(high - estimate <= 0.01)
@@ -0,0 +1,43 @@
+"""Tests the Poisson process samplers."""
+
+# pylint:disable=missing-function-docstring
+from math import sin
+import numpy as np
+import pytest
+from scipy.integrate import quad
+from src.tools.models.rng import generate_poisson, generate_poisson_nonhom
+
+
+def test_many_homogeneous_processes():
+    rng = np.random.default_rng(0)
+    processes = generate_poisson(np.array([1, 3] * 1000), 5, size=2000, rng=rng)
+    counts = np.array([len(times) for times in processes])
+    assert abs(counts[0::2].mean() - 5) < 0.3 and abs(counts[1::2].mean() - 15) < 0.5
+    assert all(np.all(np.diff(times) >= 0) and np.all((0 <= times) & (times <= 5)) for times in processes)
+    single = generate_poisson(2, 10, rng=rng)
+    assert isinstance(single, list) and single == sorted(single)
+
+
+def test_thinning_follows_the_rate():
+    rng = np.random.default_rng(1)
+    processes = generate_poisson_nonhom(lambda t: 2 * t, 5, size=4000, rng=rng)
+    times = np.concatenate(processes)
+    assert abs(len(times) / 4000 - 25) < 0.5
+    # the density of event times is proportional to t, so their mean is 2/3 of the duration
+    assert abs(times.mean() - 10 / 3) < 0.05
+    single = generate_poisson_nonhom(lambda t: 1 + sin(t), 20, rng=rng)
+    assert single == sorted(single) and all(0 <= t <= 20 for t in single)
+    capped = generate_poisson_nonhom(lambda t: 1 + sin(t), 20, max_rate=2, size=10, rng=rng)
+    assert len(capped) == 10
+
+
+def test_nonhomogeneous_majorant_covers_peaks_between_samples():
+    rng = np.random.default_rng(1)
+    # the peak lies between the samples at 0.5 and 1 of a one cell grid, well above both of them
+    def rate(t):
+        return 1 + 10 * np.exp(-((t - 0.625) / 0.2) ** 2)
+    processes = generate_poisson_nonhom(rate, 1, size=4000, rng=rng, grid_count=1)
+    expected = quad(rate, 0, 1)[0]
+    assert abs(np.mean([len(times) for times in processes]) - expected) < 0.15
+    with pytest.raises(ValueError):
+        generate_poisson_nonhom(rate, 1, max_rate=2, size=100, rng=rng)
@@ -0,0 +1,91 @@
+"""Tests the site-state (N_u, N_h, N_m) population model."""
+
+# pylint:disable=missing-function-docstring
+import random
+from math import comb
+
+import numpy as np
+from scipy.integrate import solve_ivp
+
+from src.tools.models.methylation import SiteStateCollaborative, get_methylation_level, get_site_switch_rates
+from src.constants import CONVERGENCE_TOLERANCE
+
+PARAMETERS = {
+    'b_0': 1.2,
+    'b_M': 3,
+    'd_0': 1,
+    'd_M': 1,
+    'r_uh': 0.1,
+    'r_hm': 0.5,
+    'r_mh': 0.1,
+    'r_hu': 0.1,
+    'r_uh_h': 0.5,
+    'r_uh_m': 1,
+    'r_hm_h': 1,
+    'r_hm_m': 2,
+    'r_mh_h': 0.1,
+    'r_mh_u': 0.5,
+    'r_hu_h': 0.1,
+    'r_hu_u': 1,
+}
+
+
+def test_type_space():
+    model = SiteStateCollaborative(4)
+    assert model.population_count == 15
+    assert all(sum(cell_type) == 4 for cell_type in model.types)
+
+
+def test_generator_row_sums():
+    model = SiteStateCollaborative(5)
+    generator = model.get_deterministic_model().get_generator_from_parameters(PARAMETERS)
+    birth, death, _, _ = model._get_rate_tables(PARAMETERS)
+    row_sums = np.asarray(generator.sum(axis=1)).ravel()
+    assert np.abs(row_sums - (birth - death)).max() < CONVERGENCE_TOLERANCE
+
+
+def test_extinction_matches_the_backward_equation():
+    site_count = 3
+    model = SiteStateCollaborative(site_count)
+    index = {cell_type: i for i, cell_type in enumerate(model.types)}
+
+    # the probability q_i(t) that a cell of type i has no descendants at time t solves the backward equation
+    # dq_i/dt = d_i + sum_j r_ij q_j + b_i E[q_A q_B] - total_i q_i from q = 0,
+    # and tends to the extinction probability
+    def backward_equation(_, q):
+        change = np.zeros(len(q))
+        for i, (u, h, m) in enumerate(model.types):
+            level = get_methylation_level(h, m, site_count)
+            birth = PARAMETERS["b_0"] * (1 - level) + PARAMETERS["b_M"] * level
+            death = PARAMETERS["d_0"] * (1 - level) + PARAMETERS["d_M"] * level
+            r_uh, r_hu, r_hm, r_mh = get_site_switch_rates(PARAMETERS, u, h, m, site_count)
+            switches = [(r_uh * u, (u - 1, h + 1, m)), (r_hu * h, (u + 1, h - 1, m)),
+                        (r_hm * h, (u, h - 1, m + 1)), (r_mh * m, (u, h + 1, m - 1))]
+            # each hemimethylated site passes its methylated strand to one of the daughters
+            daughters = sum(comb(h, x) / 2 ** h * q[index[(u + h - x, m + x, 0)]] * q[index[(u + x, m + h - x, 0)]]
+                            for x in range(h + 1))
+            switched = sum(rate * q[index[target]] for rate, target in switches if rate > 0)
+            total = birth + death + sum(rate for rate, _ in switches)
+            change[i] = death + birth * daughters + switched - total * q[i]
+        return change
+
+    expected = solve_ivp(backward_equation, [0, 500], np.zeros(len(model.types)), rtol=1e-10, atol=1e-12).y[:, -1]
+    probabilities = model.calculate_extinction(PARAMETERS)
+    assert np.ptp(expected) > 0.2
+    assert np.abs(probabilities - expected).max() < 1e-6
+
+
+def test_sparse_run_keeps_site_count():
+    model = SiteStateCollaborative(10)
+    state = model.run(PARAMETERS, {(0, 0, 10): 3}, 2)
+    assert all(sum(cell_type) == 10 for cell_type in state)
+    dense_state = model.run(PARAMETERS, model.to_dense({(0, 0, 10): 3}), 2)
+    assert len(dense_state) == model.population_count
+
+
+def test_rounding_past_the_last_rate_takes_a_possible_switch(monkeypatch):
+    # waiting time, firing cell, an event draw equal to the total rate, then no further event
+    draws = iter([0.5, 0.5, 1.0, 1e-300])
+    monkeypatch.setattr(random, "random", lambda: next(draws))
+    model = SiteStateCollaborative(2)
+    assert model.run(PARAMETERS, {(2, 0, 0): 1}, 2) == {(1, 1, 0): 1}
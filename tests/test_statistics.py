@@ -0,0 +1,35 @@
+"""Tests the streamed Monte Carlo estimates."""
+
+# pylint:disable=missing-function-docstring
+import numpy as np
+from src.tools.statistics import RunningMoments
+
+
+def test_merged_blocks_match_all_samples():
+    rng = np.random.default_rng(0)
+    samples = rng.normal(size=(1000, 4))
+    whole = RunningMoments(4)
+    whole.update(samples)
+    merged = RunningMoments(4)
+    for block in np.array_split(samples, 7):
+        part = RunningMoments(4)
+        part.update(block)
+        merged.merge(part)
+    assert merged.count == 1000
+    assert np.allclose(merged.mean, samples.mean(axis=0))
+    assert np.allclose(merged.get_variance(), samples.var(axis=0, ddof=1))
+    assert np.allclose(whole.get_variance(), merged.get_variance())
+
+
+def test_control_variate_reduces_error():
+    rng = np.random.default_rng(1)
+    controls = rng.normal(size=(5000, 2))
+    samples = 3 + 2 * controls + 0.1 * rng.normal(size=(5000, 2))
+    moments = RunningMoments(2)
+    moments.update(samples, controls)
+    plain_estimate, plain_error = moments.get_estimate()
+    estimate, error = moments.get_estimate(control_expectation=np.zeros(2))
+    assert np.all(error < plain_error / 10)
+    assert np.allclose(estimate, 3, atol=5 * error)
+    _, low, high = moments.get_confidence_band(0.95, np.zeros(2))
+    assert np.all((low < 3) & (3 < high))
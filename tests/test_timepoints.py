@@ -0,0 +1,79 @@
+"""Tests the array backed trajectory output."""
+
+# pylint:disable=missing-function-docstring
+import numpy as np
+from src.tools import io
+from src.tools.models.pdmp import PDMP
+from src.tools.models.timepoints import DecimatingSink, FileSink, iterate_merged_times, merge_times, read_trajectory
+from src.constants import BISTABLE_STRONG_PDMP_PARAMS
+
+
+def test_merge_times():
+    all_times, is_split = merge_times([0.5, 1, 2], [0.2, 1, 3])
+    assert all_times.tolist() == [0, 0.2, 0.5, 1, 2, 3]
+    assert is_split.tolist() == [False, True, False, True, False, True]
+
+
+def test_merged_chunks_match_one_merge():
+    rng = np.random.default_rng(2)
+    times = np.round(np.sort(rng.uniform(0, 10, 50)), 1)
+    times = np.unique(np.concatenate([times, [3, 5]]))
+    for splitting_times in ([], [0], np.unique(np.concatenate([np.sort(rng.uniform(0, 12, 20)), [3, 5]]))):
+        all_times, is_split = merge_times(times, splitting_times)
+        for chunk_size in (1, 4, 7, 100):
+            chunks = list(iterate_merged_times(times, splitting_times, chunk_size))
+            assert all(len(chunk_times) <= 2 * chunk_size + 1 for chunk_times, _ in chunks)
+            assert np.array_equal(np.concatenate([chunk_times for chunk_times, _ in chunks]), all_times)
+            assert np.array_equal(np.concatenate([chunk_is_split for _, chunk_is_split in chunks]), is_split)
+
+
+def test_requested_splitting_time_is_after_split():
+    result = PDMP().generate_timepoint_data(BISTABLE_STRONG_PDMP_PARAMS, [0.3, 0.3, 0.4], [0.5, 1], [0.5])
+    assert list(result) == [0, 0.5, 1]
+    assert result[0].tolist() == [0.3, 0.3, 0.4]
+    assert result[0.5][0] == 0 and np.isclose(result[0.5].sum(), 1)
+    assert 0.7 not in result
+    assert result.to_dict()[1] == result[1].tolist()
+
+
+def test_chunks_match_one_pass():
+    times = [i / 10 for i in range(101)]
+    splitting_times = [0.75, 2.5, 6.05]
+    model = PDMP()
+    for parameters in (BISTABLE_STRONG_PDMP_PARAMS, PDMP.convert_to_noncollaborative(BISTABLE_STRONG_PDMP_PARAMS)):
+        whole = model.generate_timepoint_data(parameters, [0, 0, 1], times, splitting_times)
+        chunked = model.generate_timepoint_data(parameters, [0, 0, 1], times, splitting_times, chunk_size=7)
+        assert np.array_equal(whole.times, chunked.times)
+        assert np.allclose(whole.states, chunked.states, atol=1e-6)
+
+
+def test_decimation_keeps_extremes_and_splits(tmp_path, monkeypatch):
+    monkeypatch.setattr(io, "BASE_PATH", str(tmp_path))
+    (tmp_path / io.TRAJECTORY_PATH).mkdir()
+    times = [i / 100 for i in range(2001)]
+    splitting_times = [3.333, 12.5]
+    model = PDMP()
+    full = model.generate_timepoint_data(BISTABLE_STRONG_PDMP_PARAMS, [0, 0, 1], times, splitting_times)
+    filename = model.generate_timepoint_data(BISTABLE_STRONG_PDMP_PARAMS, [0, 0, 1], times, splitting_times,
+                                             sink=DecimatingSink(FileSink("decimated"), 1), chunk_size=150)
+    decimated = read_trajectory(filename)
+    assert len(decimated) < len(full) / 10
+    assert decimated.is_split.sum() == 2
+    for time in (3.33, 3.333, 12.49, 12.5, 20):
+        assert np.allclose(decimated[time], full[time])
+    assert np.allclose(decimated.states.max(axis=0), full.states.max(axis=0))
+    assert np.allclose(decimated.states.min(axis=0), full.states.min(axis=0))
+
+
+def test_splits_at_the_first_and_last_times_apply_once():
+    model = PDMP()
+    for parameters in (BISTABLE_STRONG_PDMP_PARAMS, PDMP.convert_to_noncollaborative(BISTABLE_STRONG_PDMP_PARAMS)):
+        unsplit = model.generate_timepoint_data(parameters, [0.3, 0.3, 0.4], [0.5, 1], [])
+        result = model.generate_timepoint_data(parameters, [0.3, 0.3, 0.4], [0.5, 1], [1])
+        m, h, u = unsplit[1]
+        assert np.allclose(result[1], [0, m + h / 2, h / 2 + u])
+        assert result.is_split.tolist() == [False, False, True]
+        split_first = model.generate_timepoint_data(parameters, [0.3, 0.3, 0.4], [0.5, 1], [0])
+        assert np.allclose(split_first[0], [0, 0.45, 0.55])
+        from_split = model.generate_timepoint_data(parameters, [0, 0.45, 0.55], [0.5, 1], [])
+        assert np.allclose(split_first[1], from_split[1], atol=1e-6)